@@ -1,5 +1,14 @@
 import os
+import sys
+import time
 import argparse
+import hashlib
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import plotly
@@ -8,7 +17,62 @@ from plotly.subplots import make_subplots
 import plotly.express as px
 
 
+class Profiler:
+    # Records wall time, CPU time and RSS change per stage as Chrome trace events (chrome://tracing, Perfetto)
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+
+    @staticmethod
+    def rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except BaseException:
+            pass
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except BaseException:
+            return 0
+
+    @contextmanager
+    def stage(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.time()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_rss = self.rss()
+        try:
+            yield
+        finally:
+            args['cpu_ms'] = round(1000 * (time.process_time() - start_cpu), 3)
+            args['rss_delta_mb'] = round((self.rss() - start_rss) / 1000000, 3)
+            self.events.append({'name': name,
+                                'cat': 'compare',
+                                'ph': 'X',
+                                'ts': round(1000000 * start),
+                                'dur': round(1000000 * (time.perf_counter() - start_wall)),
+                                'pid': os.getpid(),
+                                'tid': threading.get_ident(),
+                                'args': args})
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        print("Wrote profile %s" % path)
+
+
+profiler = Profiler()
+
+
 class BaseCompare:
+    # Projects already reported as having no sample weights
+    unweighted_projects = set()
+
     def __init__(self, base_folder, feature_folder, export_folder, export_file):
         self.base_folder = base_folder
         self.feature_folder = feature_folder
@@ -17,91 +81,402 @@ class BaseCompare:
 
     @staticmethod
     def intersect_rows(df1, df2):
-        return df1[df1.index.isin(df2.index)]
+        with profiler.stage('intersect_rows'):
+            return df1[df1.index.isin(df2.index)]
 
     @staticmethod
     def union_columns(df1, df2):
-        cols = sorted(list(set(df1.columns) | set(df2.columns)))
-        for col in cols:
-            if col not in df1.columns:
-                df1[col] = np.nan
-        return df1[cols]
+        with profiler.stage('union_columns'):
+            cols = sorted(list(set(df1.columns) | set(df2.columns)))
+            return df1.reindex(columns=cols)
 
-    def results(self, aggregate_column=None, aggregate_function=None, excludes=[], enum_maps={}):
-        aggregate_columns = []
-        if aggregate_column:
-            aggregate_columns.append(aggregate_column)
+    @staticmethod
+    def is_numeric(dtype):
+        return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
 
-        files = []
-        for file in os.listdir(self.base_folder):
-            if file not in excludes:
-                files.append(file)
+    @staticmethod
+    def numeric_columns(df1, df2):
+        # Columns holding numbers on both sides get deltas; strings, bools and mixed columns get inequality flags
+        dtypes = df2.dtypes.to_dict()
+        return [col for col, dtype in df1.dtypes.items()
+                if col in dtypes and BaseCompare.is_numeric(dtype) and BaseCompare.is_numeric(dtypes[col])]
 
-        for file in sorted(files):
-            base_file = os.path.join(self.base_folder, file)
-            feature_file = os.path.join(self.feature_folder, file)
+    @staticmethod
+    def run_profiled(enabled, name, stage_args, fn, *args):
+        # Runs fn in a worker process and hands its profile events back to the parent
+        profiler.enabled = enabled
+        profiler.events = []
+        with profiler.stage(name, **stage_args):
+            result = fn(*args)
+        return result, profiler.events
 
-            if not os.path.exists(feature_file):
-                print("Warning: %s not found. Skipping..." % feature_file)
+    @staticmethod
+    def list_files(folder, excludes=[]):
+        files = []
+        for file in sorted(os.listdir(folder)):
+            if file in excludes or not os.path.isfile(os.path.join(folder, file)):
                 continue
+            files.append(file)
+        return files
 
-            base_df = read_csv(base_file, index_col=0)
-            feature_df = read_csv(feature_file, index_col=0)
-
-            base_df = self.intersect_rows(base_df, feature_df)
-            feature_df = self.intersect_rows(feature_df, base_df)
+    @staticmethod
+    def diff_frames(base_df, feature_df, numeric_cols=None):
+        with profiler.stage('diff'):
+            if not base_df.columns.equals(feature_df.columns):
+                base_df = BaseCompare.union_columns(base_df, feature_df)
+                feature_df = BaseCompare.union_columns(feature_df, base_df)
+            if not base_df.index.equals(feature_df.index):
+                base_df, feature_df = base_df.align(feature_df, join='outer', axis=0)
 
-            if file == 'results_output.csv':
-                base_df = base_df.select_dtypes(exclude=['string', 'bool'])
-                feature_df = feature_df.select_dtypes(exclude=['string', 'bool'])
+            if numeric_cols is None:
+                numeric_cols = BaseCompare.numeric_columns(base_df, feature_df)
+            numeric = base_df.columns.isin(numeric_cols)
 
-            try:
+            if numeric.all():
                 df = feature_df - base_df
-            except BaseException:
-                base_df = self.union_columns(base_df, feature_df)
-                feature_df = self.union_columns(feature_df, base_df)
-                df = feature_df != base_df
-                df = df.astype(int)
+            else:
+                def numbers(df):
+                    df = df.loc[:, numeric]
+                    others = [col for col, dtype in df.dtypes.items() if not BaseCompare.is_numeric(dtype)]
+                    if others:
+                        df = df.copy()
+                        df[others] = df[others].apply(pd.to_numeric, errors='coerce')
+                    return df
 
-            df = df.fillna('NA')
-            df.to_csv(os.path.join(self.export_folder, file))
+                deltas = numbers(feature_df) - numbers(base_df)
+                base_values = base_df.loc[:, ~numeric]
+                feature_values = feature_df.loc[:, ~numeric]
+                flags = (feature_values != base_values) & (feature_values.notna() | base_values.notna())
+                df = pd.concat([deltas, flags.astype(int)], axis=1)[base_df.columns]
 
-            # Get results charactersistics of groupby columns
-            if file == 'results_characteristics.csv':
-                group_df = base_df[aggregate_columns]
+        return df, base_df, feature_df
 
-            # Write grouped & aggregated results dfs
-            if file == 'results_output.csv':
-                for col, enum_map in enum_maps.items():
-                    if col in aggregate_columns:
-                        group_df[col] = group_df[col].map(enum_map)
+    @staticmethod
+    def file_hash(path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
 
-                # Merge groupby df and aggregate
-                sim_ct_base = len(base_df)
-                sim_ct_feature = len(feature_df)
-                if aggregate_columns:
-                    base_df = group_df.merge(base_df, 'outer', left_index=True, right_index=True)\
-                                      .groupby(aggregate_columns)
-                    feature_df = group_df.merge(feature_df, 'outer', left_index=True, right_index=True)\
-                                         .groupby(aggregate_columns)
-                    if aggregate_function == 'sum':
-                        base_df = base_df.sum(min_count=1).stack(dropna=False)
-                        feature_df = feature_df.sum(min_count=1).stack(dropna=False)
-                    elif aggregate_function == 'mean':
-                        base_df = base_df.mean(numeric_only=True).stack(dropna=False)
-                        feature_df = feature_df.mean(numeric_only=True).stack(dropna=False)
-                else:
-                    if aggregate_function == 'sum':
-                        base_df = base_df.sum(min_count=1)
-                        feature_df = feature_df.sum(min_count=1)
-                    elif aggregate_function == 'mean':
-                        base_df = base_df.mean(numeric_only=True)
-                        feature_df = feature_df.mean(numeric_only=True)
+    @staticmethod
+    def diff_file(file, base_file, feature_file, export_file, return_frames=False, manifest_folder=None):
+        if manifest_folder:
+            manifest_file = os.path.join(manifest_folder, file + '.json')
+            rows_file = os.path.join(manifest_folder, file + '.rows.csv')
+            hashes = {'base': BaseCompare.file_hash(base_file), 'feature': BaseCompare.file_hash(feature_file)}
+            manifest = {}
+            if os.path.exists(manifest_file) and os.path.exists(export_file):
+                with open(manifest_file) as f:
+                    manifest = json.load(f)
+                # The export file was since written by something else, e.g. a run without --incremental
+                if manifest.get('export') != BaseCompare.file_hash(export_file):
+                    manifest = {}
 
-        if not aggregate_function:
+            # Neither file changed since the last run, so its diff output is still valid
+            if not return_frames and manifest.get('files') == hashes:
+                return
+
+        base_df = read_csv(base_file, index_col=0)
+        feature_df = read_csv(feature_file, index_col=0)
+
+        base_df = BaseCompare.intersect_rows(base_df, feature_df)
+        feature_df = BaseCompare.intersect_rows(feature_df, base_df)
+
+        if file == 'results_output.csv':
+            base_df = base_df.select_dtypes(exclude=['string', 'bool'])
+            feature_df = feature_df.select_dtypes(exclude=['string', 'bool'])
+
+        if not manifest_folder:
+            df, base_df, feature_df = BaseCompare.diff_frames(base_df, feature_df)
+            df = df.fillna('NA')
+            with profiler.stage('write_csv', file=file):
+                df.to_csv(export_file)
+
+            if return_frames:
+                return base_df, feature_df
             return
 
-        # Write aggregate results df
+        signature = repr([(list(df.columns), [str(t) for t in df.dtypes]) for df in [base_df, feature_df]])
+        signature = hashlib.sha1(signature.encode('utf-8')).hexdigest()
+        rows = pd.DataFrame({'base': pd.util.hash_pandas_object(base_df).astype(str),
+                             'feature': pd.util.hash_pandas_object(feature_df).reindex(base_df.index).astype(str)})
+        rows.index = base_df.index.astype(str)
+
+        lines = None
+        if not return_frames and manifest.get('signature') == signature and base_df.index.equals(feature_df.index) \
+                and os.path.exists(rows_file):
+            prev_rows = pd.read_csv(rows_file, index_col=0, dtype=str, keep_default_na=False)
+            with open(export_file) as f:
+                lines = f.readlines()
+            if len(lines) - 1 != len(prev_rows) or rows.index.has_duplicates or prev_rows.index.has_duplicates:
+                lines = None
+
+        if lines is None:
+            df, base_df, feature_df = BaseCompare.diff_frames(base_df, feature_df)
+            df = df.fillna('NA')
+            with profiler.stage('write_csv', file=file):
+                df.to_csv(export_file)
+        else:
+            # Only rows whose base or feature content changed are re-diffed; the rest keep their prior output lines
+            changed = (rows != prev_rows.reindex(rows.index)).any(axis=1).values
+            df, _, _ = BaseCompare.diff_frames(base_df[changed], feature_df[changed])
+            df = df.fillna('NA')
+            new_lines = df.to_csv().splitlines(keepends=True)
+            if new_lines[0] != lines[0]:
+                df, base_df, feature_df = BaseCompare.diff_frames(base_df, feature_df)
+                df = df.fillna('NA')
+                df.to_csv(export_file)
+            else:
+                prev_lines = dict(zip(prev_rows.index, lines[1:]))
+                new_lines = iter(new_lines[1:])
+                with open(export_file, 'w') as f:
+                    f.write(lines[0])
+                    for label, is_changed in zip(rows.index, changed):
+                        f.write(next(new_lines) if is_changed else prev_lines[label])
+                print("%s: re-diffed %s of %s rows" % (file, changed.sum(), len(rows)))
+
+        if not os.path.exists(manifest_folder):
+            os.makedirs(manifest_folder, exist_ok=True)
+        rows.to_csv(rows_file)
+        with open(manifest_file, 'w') as f:
+            json.dump({'files': hashes, 'signature': signature, 'export': BaseCompare.file_hash(export_file)}, f)
+
+        if return_frames:
+            return base_df, feature_df
+
+    @staticmethod
+    def aligned_chunks(base_file, feature_file, chunksize, **kwargs):
+        # Yields equally indexed row chunks of the rows shared by both files, which must list them in the same order
+        base_index = read_csv(base_file, usecols=[0], **kwargs).iloc[:, 0]
+        feature_index = read_csv(feature_file, usecols=[0], **kwargs).iloc[:, 0]
+        base_keep = base_index.isin(feature_index).values
+        feature_keep = feature_index.isin(base_index).values
+
+        def shared_rows(csv_file_path, keep):
+            start = 0
+            for chunk in read_csv(csv_file_path, index_col=0, chunksize=chunksize, **kwargs):
+                yield chunk[keep[start:start + len(chunk)]]
+                start += len(chunk)
+
+        base_chunks = shared_rows(base_file, base_keep)
+        feature_chunks = shared_rows(feature_file, feature_keep)
+        base_df = next(base_chunks, None)
+        feature_df = next(feature_chunks, None)
+        while base_df is not None and feature_df is not None:
+            n = min(len(base_df), len(feature_df))
+            if not base_df.index[:n].equals(feature_df.index[:n]):
+                raise ValueError("%s and %s must list their rows in the same order to be compared in chunks." % (base_file, feature_file))
+            if n:
+                yield base_df.iloc[:n], feature_df.iloc[:n]
+
+            base_df = base_df.iloc[n:]
+            feature_df = feature_df.iloc[n:]
+            if base_df.empty:
+                base_df = next(base_chunks, None)
+            if feature_df.empty:
+                feature_df = next(feature_chunks, None)
+
+    @staticmethod
+    def stream_diff_file(base_file, feature_file, export_file, chunksize, aggregate=False, group_df=None, aggregate_columns=[],
+                         weights=None):
+        # Writes the diff chunk by chunk, keeping only running sums, counts and weight totals for the aggregate deltas
+        totals = {}
+        columns = {}
+        n_rows = 0
+        header = True
+        for base_df, feature_df in BaseCompare.aligned_chunks(base_file, feature_file, chunksize):
+            frames = {'base': base_df, 'feature': feature_df}
+
+            # Classify columns on the first chunk so every chunk is diffed and aggregated the same way
+            if not columns:
+                for key, df in frames.items():
+                    df = df.select_dtypes(exclude=['string', 'bool'])
+                    columns[key] = (df.columns, df.select_dtypes(include='number').columns)
+                numeric_cols = BaseCompare.numeric_columns(base_df[columns['base'][0]], feature_df[columns['feature'][0]])
+
+            for key, df in frames.items():
+                frames[key] = df[columns[key][0]]
+
+            df, _, _ = BaseCompare.diff_frames(frames['base'], frames['feature'], numeric_cols)
+            df = df.fillna('NA')
+            with profiler.stage('write_csv', file=export_file):
+                df.to_csv(export_file, mode='w' if header else 'a', header=header)
+            header = False
+            n_rows += len(base_df)
+
+            if not aggregate:
+                continue
+
+            with profiler.stage('aggregate', file=export_file):
+                for key, df in frames.items():
+                    df = df[columns[key][1]].apply(pd.to_numeric, errors='coerce')
+                    present = None
+                    if weights is not None:
+                        w = BaseCompare.align_weights(df.index, weights)
+                        present = df.notna().mul(w, axis=0)
+                        df = df.mul(w, axis=0)
+                    if aggregate_columns:
+                        keys = [group_df[col].reindex(df.index) for col in aggregate_columns]
+                        df = df.groupby(keys)
+                        if present is not None:
+                            present = present.groupby(keys)
+                    sums, counts = df.sum(), df.count()
+                    weight_totals = counts if present is None else present.sum()
+                    if key in totals:
+                        sums = totals[key][0].add(sums, fill_value=0)
+                        counts = totals[key][1].add(counts, fill_value=0)
+                        weight_totals = totals[key][2].add(weight_totals, fill_value=0)
+                    totals[key] = (sums, counts, weight_totals)
+
+        if header:
+            pd.DataFrame().to_csv(export_file)
+
+        return totals, n_rows
+
+    def cached_aggregates(self, manifest_folder, key):
+        manifest_file = os.path.join(manifest_folder, 'aggregates.json')
+        aggregates_file = os.path.join(manifest_folder, 'aggregates.csv')
+        if not os.path.exists(manifest_file) or not os.path.exists(aggregates_file):
+            return None
+
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest['key'] != key or 'functions' not in manifest:
+            return None
+
+        df = pd.read_csv(aggregates_file, index_col=list(range(manifest['levels'])), float_precision='round_trip')
+        base_aggregates = {function: df['base ' + function] for function in manifest['functions']}
+        feature_aggregates = {function: df['feature ' + function] for function in manifest['functions']}
+        return base_aggregates, feature_aggregates, manifest['sim_ct_base'], manifest['sim_ct_feature']
+
+    def save_aggregates(self, manifest_folder, key, base_aggregates, feature_aggregates, sim_ct_base, sim_ct_feature):
+        if not os.path.exists(manifest_folder):
+            os.makedirs(manifest_folder, exist_ok=True)
+
+        df = {}
+        for function in base_aggregates:
+            df['base ' + function] = base_aggregates[function]
+            df['feature ' + function] = feature_aggregates[function]
+        df = pd.DataFrame(df)
+        df.to_csv(os.path.join(manifest_folder, 'aggregates.csv'))
+        with open(os.path.join(manifest_folder, 'aggregates.json'), 'w') as f:
+            json.dump({'key': key,
+                       'levels': df.index.nlevels,
+                       'functions': list(base_aggregates),
+                       'sim_ct_base': int(sim_ct_base),
+                       'sim_ct_feature': int(sim_ct_feature)}, f)
+
+    @staticmethod
+    def aggregate_stat(df, aggregate_function):
+        # df is either a DataFrame or a grouped DataFrame, which share these reductions
+        if aggregate_function == 'sum':
+            return df.sum(min_count=1)
+        elif aggregate_function == 'mean':
+            return df.mean(numeric_only=True)
+        elif aggregate_function == 'count':
+            return df.count()
+        elif aggregate_function in ['min', 'max', 'median']:
+            return getattr(df, aggregate_function)(numeric_only=True)
+        elif aggregate_function.startswith('q') and aggregate_function[1:].isdigit():
+            return df.quantile(int(aggregate_function[1:]) / 100, numeric_only=True)
+        raise ValueError("Unknown aggregate function '%s'." % aggregate_function)
+
+    @staticmethod
+    def read_weights(buildstock_file, project='project_testing'):
+        # sample_weight of a precomputed buildstock.csv, keyed by the OSW name of each building in the given project
+        df = read_csv(buildstock_file)
+        if 'sample_weight' not in df.columns:
+            raise ValueError("%s has no sample_weight column." % buildstock_file)
+        index = pd.Index(['{}-{}.osw'.format(project, '%04d' % building) for building in df['Building']], name='OSW')
+        return pd.Series(df['sample_weight'].astype(float).values, index=index)
+
+    @staticmethod
+    def read_project_weights(buildstock_files, project='project_testing'):
+        # One precomputed buildstock.csv per project, each given as project=path or as a path of the default project
+        weights = []
+        for buildstock_file in buildstock_files:
+            name, sep, path = buildstock_file.partition('=')
+            if not sep or os.path.exists(buildstock_file):
+                name, path = project, buildstock_file
+            weights.append(BaseCompare.read_weights(path, name))
+        return pd.concat(weights)
+
+    @staticmethod
+    def align_weights(index, weights):
+        # Rows of projects without any weights are left out with a zero weight; a weighted project missing rows is an error
+        aligned = weights.reindex(index).to_numpy(dtype=float)
+        missing = np.isnan(aligned)
+        if missing.any():
+            projects = pd.Index(index).astype(str).str.rsplit('-', n=1).str[0]
+            unweighted = missing & ~projects.isin(weights.index.str.rsplit('-', n=1).str[0].unique())
+            if (missing & ~unweighted).any():
+                raise ValueError("No sample weight found for %s rows, e.g. %s." % ((missing & ~unweighted).sum(),
+                                                                                 index[missing & ~unweighted][0]))
+            for project in sorted(set(projects[unweighted]) - BaseCompare.unweighted_projects):
+                print("Warning: no sample weights for %s. Skipping its rows..." % project)
+                BaseCompare.unweighted_projects.add(project)
+            aligned[unweighted] = 0.0
+        return aligned
+
+    @staticmethod
+    def weighted_sums(df, grouped, aggregate_columns, weights):
+        # Weighted sums are dot products of the weight vector with each column, so rows are never replicated;
+        # with groups the rows are sorted by group code and each group's slice is reduced at once
+        values = df.drop(columns=aggregate_columns)
+        numeric_cols = values.select_dtypes(include='number').columns
+        x = values[numeric_cols].to_numpy(dtype=float)
+        present = ~np.isnan(x)
+        x = np.where(present, x, 0.0)
+        w = BaseCompare.align_weights(df.index, weights)
+
+        if not aggregate_columns:
+            sums = pd.Series(w @ x, index=numeric_cols).reindex(values.columns)
+            totals = pd.Series(w @ present, index=numeric_cols).reindex(values.columns)
+            return sums, totals
+
+        codes = grouped.ngroup().to_numpy()
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        starts = np.searchsorted(codes[order], np.arange(grouped.ngroups))
+        weighted = x[order] * w[order, None]
+        groups = grouped.size().index
+        sums = pd.DataFrame(np.add.reduceat(weighted, starts, axis=0), index=groups, columns=numeric_cols)
+        totals = pd.DataFrame(np.add.reduceat(present[order] * w[order, None], starts, axis=0), index=groups,
+                              columns=numeric_cols)
+        return sums.reindex(columns=values.columns), totals.reindex(columns=values.columns)
+
+    @staticmethod
+    def aggregate_frames(df, group_df, aggregate_columns, aggregate_functions, weights=None):
+        # The rows are grouped once and every statistic reuses that grouping's codes
+        grouped = df
+        if aggregate_columns:
+            df = group_df.merge(df, 'outer', left_index=True, right_index=True)
+            grouped = df.groupby(aggregate_columns)
+
+        # Sums and means are weighted by sample_weight when weights are given; other statistics are per sample
+        sums = None
+        if weights is not None and set(aggregate_functions) & set(['sum', 'mean']):
+            sums, totals = BaseCompare.weighted_sums(df, grouped, aggregate_columns, weights)
+
+        aggregates = {}
+        for aggregate_function in aggregate_functions:
+            if sums is not None and aggregate_function == 'sum':
+                aggregates[aggregate_function] = sums.where(totals > 0)
+            elif sums is not None and aggregate_function == 'mean':
+                aggregates[aggregate_function] = sums / totals.where(totals > 0)
+            else:
+                aggregates[aggregate_function] = BaseCompare.aggregate_stat(grouped, aggregate_function)
+            if aggregate_columns:
+                aggregates[aggregate_function] = aggregates[aggregate_function].stack(dropna=False)
+        return aggregates
+
+    @staticmethod
+    def aggregate_frame(df, group_df, aggregate_columns, aggregate_function, weights=None):
+        return BaseCompare.aggregate_frames(df, group_df, aggregate_columns, [aggregate_function], weights)[aggregate_function]
+
+    @staticmethod
+    def aggregate_deltas(base_df, feature_df, sim_ct_base, sim_ct_feature, aggregate_columns):
         deltas = pd.DataFrame()
         deltas['base'] = base_df
         deltas['feature'] = feature_df
@@ -120,23 +495,272 @@ class BaseCompare:
                                index=['simulation_count'])
         sims_df[aggregate_columns] = 'n/a'
         deltas = pd.concat([sims_df, deltas])
-        for group in aggregate_columns:
+        # Inserting the last key first leaves the key columns in the given order, matching the row nesting
+        for group in reversed(aggregate_columns):
             first_col = deltas.pop(group)
             deltas.insert(0, group, first_col)
 
-        basename, ext = os.path.splitext(file)
-        if aggregate_columns:
-            basename += '_{aggregate_column}'.format(aggregate_column=aggregate_columns[0])
+        return deltas
+
+    def results(self, aggregate_column=None, aggregate_function=None, excludes=[], enum_maps={}, jobs=1, chunksize=None,
+                incremental=False, weights=None):
+        # aggregate_column and aggregate_function may each be one value or a list; one delta table is written per function.
+        # weights is an optional sample_weight series keyed by OSW name (see read_weights).
+        aggregate_columns = []
+        if aggregate_column:
+            aggregate_columns += [aggregate_column] if isinstance(aggregate_column, str) else list(aggregate_column)
+
+        aggregate_functions = []
+        if aggregate_function:
+            aggregate_functions += [aggregate_function] if isinstance(aggregate_function, str) else list(aggregate_function)
+
+        files = []
+        for file in self.list_files(self.base_folder, excludes):
+            if not os.path.exists(os.path.join(self.feature_folder, file)):
+                print("Warning: %s not found. Skipping..." % os.path.join(self.feature_folder, file))
+                continue
 
-        deltas.to_csv(
-            os.path.join(
-                self.export_folder,
-                self.export_file))
+            files.append(file)
+
+        # results_output.csv can be diffed in chunks to bound memory for very large runs
+        stream_files = []
+        if chunksize:
+            stream_files = [file for file in files if file == 'results_output.csv']
+            for function in aggregate_functions:
+                if function not in ['sum', 'mean', 'count']:
+                    raise ValueError("Aggregate function '%s' is not supported with chunksize." % function)
+
+        # With incremental runs, unchanged files reuse their prior diffs and the aggregates are reused when
+        # neither the characteristics nor the outputs changed
+        manifest_folder = None
+        aggregates = None
+        if incremental:
+            manifest_folder = os.path.join(self.export_folder, MANIFEST_FOLDER)
+            if aggregate_function:
+                aggregates_key = [aggregate_columns, aggregate_functions, sorted((k, sorted(v.items())) for k, v in enum_maps.items())]
+                if weights is not None:
+                    aggregates_key.append(hashlib.sha1(pd.util.hash_pandas_object(weights).values.tobytes()).hexdigest())
+                for file in ['results_characteristics.csv', 'results_output.csv']:
+                    if file in files:
+                        aggregates_key += [self.file_hash(os.path.join(self.base_folder, file)),
+                                self.file_hash(os.path.join(self.feature_folder, file))]
+                aggregates_key = hashlib.sha1(repr(aggregates_key).encode('utf-8')).hexdigest()
+                aggregates = self.cached_aggregates(manifest_folder, aggregates_key)
+
+        # Only the files feeding the aggregate deltas are sent back from the diff workers
+        tasks = []
+        for file in files:
+            if file in stream_files:
+                continue
+            return_frames = bool(aggregate_function) and file in ['results_characteristics.csv', 'results_output.csv']
+            return_frames = return_frames and aggregates is None
+            tasks.append((file,
+                          os.path.join(self.base_folder, file),
+                          os.path.join(self.feature_folder, file),
+                          os.path.join(self.export_folder, file),
+                          return_frames,
+                          manifest_folder))
+
+        outputs = {}
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(self.run_profiled, profiler.enabled, 'diff_file', {'file': task[0]}, self.diff_file, *task)
+                           for task in tasks]
+                for task, future in zip(tasks, futures):
+                    outputs[task[0]], events = future.result()
+                    profiler.events += events
+        else:
+            for task in tasks:
+                with profiler.stage('diff_file', file=task[0]):
+                    outputs[task[0]] = self.diff_file(*task)
+
+        # Merge in sorted file order so the aggregate deltas don't depend on worker scheduling
+        group_df = None
+        for file in files:
+            if file in stream_files:
+                if aggregates is not None:
+                    self.stream_diff_file(os.path.join(self.base_folder, file),
+                                          os.path.join(self.feature_folder, file),
+                                          os.path.join(self.export_folder, file),
+                                          chunksize)
+                    continue
+
+                if aggregate_function:
+                    for col, enum_map in enum_maps.items():
+                        if col in aggregate_columns:
+                            group_df[col] = group_df[col].map(enum_map)
+
+                with profiler.stage('stream_diff_file', file=file):
+                    totals, n_rows = self.stream_diff_file(os.path.join(self.base_folder, file),
+                                                           os.path.join(self.feature_folder, file),
+                                                           os.path.join(self.export_folder, file),
+                                                           chunksize,
+                                                           bool(aggregate_function),
+                                                           group_df,
+                                                           aggregate_columns,
+                                                           weights)
+                if not aggregate_function:
+                    continue
+
+                sim_ct_base = n_rows
+                sim_ct_feature = n_rows
+                streamed = {}
+                for key, (sums, counts, weight_totals) in totals.items():
+                    streamed[key] = {}
+                    for function in aggregate_functions:
+                        if function == 'sum':
+                            streamed[key][function] = sums.where(counts > 0)
+                        elif function == 'mean':
+                            streamed[key][function] = sums / weight_totals.where(counts > 0)
+                        elif function == 'count':
+                            streamed[key][function] = counts.astype(int)
+                        if aggregate_columns:
+                            groups = group_df.groupby(aggregate_columns).size().index
+                            streamed[key][function] = streamed[key][function].reindex(groups).stack(dropna=False)
+                base_df = streamed['base']
+                feature_df = streamed['feature']
+                continue
+
+            frames = outputs[file]
+            if frames is None:
+                continue
+
+            base_df, feature_df = frames
+
+            # Get results charactersistics of groupby columns
+            if file == 'results_characteristics.csv':
+                group_df = base_df[aggregate_columns]
+
+            # Write grouped & aggregated results dfs
+            if file == 'results_output.csv':
+                for col, enum_map in enum_maps.items():
+                    if col in aggregate_columns:
+                        group_df[col] = group_df[col].map(enum_map)
+
+                # Merge groupby df and aggregate
+                with profiler.stage('aggregate', file=file):
+                    sim_ct_base = len(base_df)
+                    sim_ct_feature = len(feature_df)
+                    base_df = self.aggregate_frames(base_df, group_df, aggregate_columns, aggregate_functions, weights)
+                    feature_df = self.aggregate_frames(feature_df, group_df, aggregate_columns, aggregate_functions, weights)
+
+        if not aggregate_function:
+            return
+
+        if aggregates is not None:
+            base_df, feature_df, sim_ct_base, sim_ct_feature = aggregates
+        elif incremental:
+            self.save_aggregates(manifest_folder, aggregates_key, base_df, feature_df, sim_ct_base, sim_ct_feature)
+
+        # Write aggregate results df, one per aggregate function
+        for aggregate_function in aggregate_functions:
+            deltas = self.aggregate_deltas(base_df[aggregate_function], feature_df[aggregate_function],
+                                           sim_ct_base, sim_ct_feature, aggregate_columns)
+
+            export_file = self.export_file
+            if len(aggregate_functions) > 1:
+                basename, ext = os.path.splitext(self.export_file)
+                export_file = '{basename}_{aggregate_function}{ext}'.format(basename=basename,
+                                                                            aggregate_function=aggregate_function,
+                                                                            ext=ext)
+
+            deltas.to_csv(
+                os.path.join(
+                    self.export_folder,
+                    export_file))
+
+    @staticmethod
+    def column_tolerances(cols, tolerances, abs_tol=0.0, rel_tol=0.0):
+        # Tolerances are keyed by column family prefix (e.g. 'Energy Use'); the longest matching prefix wins
+        abs_tols, rel_tols = [], []
+        for col in cols:
+            family = max([key for key in tolerances if str(col).startswith(key)], key=len, default=None)
+            tolerance = tolerances.get(family, (abs_tol, rel_tol))
+            abs_tols.append(tolerance[0])
+            rel_tols.append(tolerance[1])
+        return np.array(abs_tols, dtype=float), np.array(rel_tols, dtype=float)
+
+    def check(self, tolerances={}, abs_tol=0.0, rel_tol=0.0, excludes=[]):
+        # Pass/fail comparison for CI: stops at the first file with values changed beyond tolerance and returns
+        # the number of violations, writing only the offending cells to check.csv
+        filepath = os.path.join(self.export_folder, 'check.csv')
+        if os.path.exists(filepath):
+            # A check.csv left by an earlier failing run would otherwise outlive a passing one
+            os.remove(filepath)
+
+        for file in self.list_files(self.base_folder, excludes):
+            base_file = os.path.join(self.base_folder, file)
+            feature_file = os.path.join(self.feature_folder, file)
+
+            if not os.path.exists(feature_file):
+                print("Warning: %s not found. Skipping..." % feature_file)
+                continue
+
+            with profiler.stage('check', file=file):
+                base_df = read_csv(base_file, index_col=0)
+                feature_df = read_csv(feature_file, index_col=0)
+
+                violations = []
+                for label in base_df.index.difference(feature_df.index):
+                    violations.append((label, 'n/a', 'row', 'missing', 'n/a'))
+                for label in feature_df.index.difference(base_df.index):
+                    violations.append((label, 'n/a', 'missing', 'row', 'n/a'))
+                for col in base_df.columns.difference(feature_df.columns):
+                    violations.append(('n/a', col, 'column', 'missing', 'n/a'))
+                for col in feature_df.columns.difference(base_df.columns):
+                    violations.append(('n/a', col, 'missing', 'column', 'n/a'))
+
+                base_df = self.intersect_rows(base_df, feature_df)
+                feature_df = self.intersect_rows(feature_df, base_df)
+                cols = base_df.columns.intersection(feature_df.columns, sort=False)
+                base_df = base_df[cols]
+                feature_df = feature_df[cols].reindex(base_df.index)
+
+                numeric_cols = self.numeric_columns(base_df, feature_df)
+                numeric = cols.isin(numeric_cols)
+
+                b = base_df.loc[:, numeric].to_numpy(dtype=float, na_value=np.nan)
+                f = feature_df.loc[:, numeric].to_numpy(dtype=float, na_value=np.nan)
+                abs_tols, rel_tols = self.column_tolerances(cols[numeric], tolerances, abs_tol, rel_tol)
+                with np.errstate(invalid='ignore'):
+                    bad = np.abs(f - b) > abs_tols + rel_tols * np.abs(b)
+                bad |= np.isnan(b) != np.isnan(f)
+                for i, j in zip(*np.nonzero(bad)):
+                    violations.append((base_df.index[i], cols[numeric][j], b[i, j], f[i, j], f[i, j] - b[i, j]))
+
+                b = base_df.loc[:, ~numeric]
+                f = feature_df.loc[:, ~numeric]
+                bad = ((f != b) & (f.notna() | b.notna())).to_numpy()
+                for i, j in zip(*np.nonzero(bad)):
+                    violations.append((b.index[i], b.columns[j], b.iat[i, j], f.iat[i, j], 'n/a'))
+
+            if not violations:
+                print("%s: OK" % file)
+                continue
+
+            df = pd.DataFrame(violations, columns=[base_df.index.name or 'row', 'column', 'base', 'feature', 'diff'])
+            df.insert(0, 'file', file)
+            df = df.fillna('NA')
+            df.to_csv(filepath, index=False)
+
+            print("%s: %s values changed beyond tolerance in %s rows and %s columns. Wrote %s" %
+                  (file, len(df), df.iloc[:, 1].nunique(), df['column'].nunique(), filepath))
+            return len(df)
+
+        return 0
 
     def visualize(self, aggregate_column=None, aggregate_function=None, display_column=None,
-                  excludes=[], enum_maps={}, cols_to_ignore=[]):
+                  excludes=[], enum_maps={}, cols_to_ignore=[], webgl_threshold=1000, max_points=100000, frames={},
+                  weights=None):
+        # frames optionally holds already loaded csvs keyed by path, so callers rendering many figures read them once.
+        # With weights, aggregates are weighted and marker sizes follow the stock each point represents.
         colors = px.colors.qualitative.Dark24
 
+        def read_results(csv_file_path):
+            if csv_file_path in frames:
+                return frames[csv_file_path]
+            return read_csv(csv_file_path, index_col=0)
+
         aggregate_columns = []
         if aggregate_column:
             aggregate_columns.append(aggregate_column)
@@ -145,24 +769,19 @@ class BaseCompare:
         if display_column:
             display_columns.append(display_column)
 
-        files = []
-        for file in os.listdir(self.base_folder):
-            if file not in excludes:
-                files.append(file)
+        files = self.list_files(self.base_folder, excludes)
 
         if display_columns or aggregate_columns:
-            base_characteristics_df = read_csv(
+            base_characteristics_df = read_results(
                 os.path.join(
                     self.base_folder,
-                    'results_characteristics.csv'),
-                index_col=0)[
+                    'results_characteristics.csv'))[
                 display_columns +
                 aggregate_columns]
-            feature_characteristics_df = read_csv(
+            feature_characteristics_df = read_results(
                 os.path.join(
                     self.feature_folder,
-                    'results_characteristics.csv'),
-                index_col=0)[
+                    'results_characteristics.csv'))[
                 display_columns +
                 aggregate_columns]
 
@@ -180,28 +799,79 @@ class BaseCompare:
 
             return (min_value, max_value)
 
-        def add_error_lines(fig, showlegend, row, col, min_value, max_value):
-            fig.add_trace(go.Scatter(x=[min_value, max_value], y=[min_value, max_value],
-                                     line=dict(color='black', dash='dash', width=1), mode='lines',
-                                     showlegend=showlegend, name='0% Error'), row=row, col=col)
-            fig.add_trace(go.Scatter(x=[min_value, max_value], y=[0.9 * min_value, 0.9 * max_value],
-                                     line=dict(color='black', dash='dashdot', width=1), mode='lines',
-                                     showlegend=showlegend, name='+/- 10% Error'), row=row, col=col)
-            fig.add_trace(go.Scatter(x=[min_value, max_value], y=[1.1 * min_value, 1.1 * max_value],
-                                     line=dict(color='black', dash='dashdot', width=1), mode='lines',
-                                     showlegend=False), row=row, col=col)
+        def error_lines(showlegend, min_value, max_value):
+            return [go.Scatter(x=[min_value, max_value], y=[min_value, max_value],
+                               line=dict(color='black', dash='dash', width=1), mode='lines',
+                               showlegend=showlegend, name='0% Error'),
+                    go.Scatter(x=[min_value, max_value], y=[0.9 * min_value, 0.9 * max_value],
+                               line=dict(color='black', dash='dashdot', width=1), mode='lines',
+                               showlegend=showlegend, name='+/- 10% Error'),
+                    go.Scatter(x=[min_value, max_value], y=[1.1 * min_value, 1.1 * max_value],
+                               line=dict(color='black', dash='dashdot', width=1), mode='lines',
+                               showlegend=False)]
 
         def remove_columns(cols):
-            for col in cols[:]:
-                if all(v == 0 for v in base_df[col].values) and all(v == 0 for v in feature_df[col].values):
-                    cols.remove(col)
-            for col in cols[:]:
-                for col_to_ignore in cols_to_ignore:
-                    if col_to_ignore in col:
-                        cols.remove(col)
+            zeros = (base_df[cols] == 0).all() & (feature_df[cols] == 0).all()
+            cols = [col for col in cols if not zeros[col]]
+            cols = [col for col in cols if not any(col_to_ignore in col for col_to_ignore in cols_to_ignore)]
             return cols
 
-        for file in sorted(files):
+        def split_groups(df, groups):
+            if not display_columns:
+                return {None: df}
+            splits = dict(list(df.groupby(display_columns[0], sort=False)))
+            return {group: df if not group else splits.get(group, df.iloc[0:0]) for group in groups}
+
+        def sample_points(x_col, y_col, color, size):
+            # Keep the points furthest from the 1:1 line when a trace exceeds max_points
+            if not max_points or len(x_col) <= max_points:
+                return x_col, y_col, color, size, 0
+
+            error = np.abs(pd.to_numeric(y_col, errors='coerce').values - pd.to_numeric(x_col, errors='coerce').values)
+            keep = np.sort(np.argsort(-error, kind='stable')[:max_points])
+            if size is not None:
+                size = size[keep]
+            return x_col.iloc[keep], y_col.iloc[keep], [color[i] for i in keep], size, len(x_col) - max_points
+
+        def prepare_group(x, y, cols):
+            # Aggregate once per display group; every column's traces are then sliced from these frames
+            if not aggregate_function:
+                color = [colors[0]] * len(y)
+                if 'color_index' in y.columns.values:
+                    color = [colors[i] for i in y['color_index']]
+                sizes = None
+                if weights is not None:
+                    # Marker area scales with sample weight; an average-weight point keeps the default size
+                    w = self.align_weights(x.index, weights)
+                    sizes = 12 * np.sqrt(w / (w[w > 0].mean() if (w > 0).any() else 1.0))
+                return x, y, sizes, color, None
+
+            if weights is not None:
+                # Weighted totals are shown as text; marker sizes are rescaled to the sample count for comparability
+                w = pd.Series(self.align_weights(x.index, weights), index=x.index)
+                sizes = w.groupby([x[col] for col in aggregate_columns]).sum()
+                n_samples = len(x)
+                stats = {}
+                for key, df in [('x', x), ('y', y)]:
+                    df = df[aggregate_columns + cols]
+                    sums, totals = self.weighted_sums(df, df.groupby(aggregate_columns), aggregate_columns, weights)
+                    stats[key] = sums if aggregate_function == 'sum' else sums / totals.where(totals > 0)
+                x, y = stats['x'], stats['y'].reindex(stats['x'].index)
+                sizes = sizes.reindex(x.index)
+                return x, y, sizes * n_samples / sizes.sum(), None, sizes.round(1)
+
+            sizes = x.groupby(aggregate_columns).size()
+            if aggregate_function == 'sum':
+                x = x.groupby(aggregate_columns)[cols].sum()
+                y = y.groupby(aggregate_columns)[cols].sum()
+            elif aggregate_function == 'mean':
+                x = x.groupby(aggregate_columns)[cols].mean()
+                y = y.groupby(aggregate_columns)[cols].mean()
+            y = y.reindex(x.index)
+            sizes = sizes.reindex(x.index)
+            return x, y, sizes, None, sizes
+
+        for file in files:
             base_file = os.path.join(self.base_folder, file)
             feature_file = os.path.join(self.feature_folder, file)
 
@@ -209,28 +879,25 @@ class BaseCompare:
                 print("Warning: %s not found. Skipping..." % feature_file)
                 continue
 
-            base_df = read_csv(base_file, index_col=0)
-            feature_df = read_csv(feature_file, index_col=0)
+            base_df = read_results(base_file)
+            feature_df = read_results(feature_file)
 
             base_df = self.intersect_rows(base_df, feature_df)
             feature_df = self.intersect_rows(feature_df, base_df)
 
-            for col in base_df.columns:
-                if base_df[col].isnull().all():
-                    base_df.drop(col, axis=1, inplace=True)
-            for col in feature_df.columns:
-                if feature_df[col].isnull().all():
-                    feature_df.drop(col, axis=1, inplace=True)
+            base_df = base_df.dropna(axis=1, how='all')
+            feature_df = feature_df.dropna(axis=1, how='all')
 
             cols = sorted(list(set(base_df.columns) & set(feature_df.columns)))
             cols = remove_columns(cols)
             n_cols = max(len(cols), 1)
 
-            groups = [None]
-            if display_columns:
+            if display_columns or aggregate_columns:
                 base_df = base_characteristics_df.join(base_df, how='right')
                 feature_df = feature_characteristics_df.join(feature_df, how='right')
 
+            groups = [None]
+            if display_columns:
                 for col, enum_map in enum_maps.items():
                     if col in display_columns:
                         for df in [base_df, feature_df]:
@@ -239,78 +906,79 @@ class BaseCompare:
                 groups = list(base_df[display_columns[0]].unique())
             n_groups = max(len(groups), 1)
 
+            with profiler.stage('prepare_groups', file=file):
+                base_groups = split_groups(base_df, groups)
+                feature_groups = split_groups(feature_df, groups)
+                prepared = {group: prepare_group(base_groups[group], feature_groups[group], cols) for group in groups}
+
             vertical_spacing = 0.3 / n_cols
-            fig = make_subplots(
-                rows=n_cols,
-                cols=n_groups,
-                subplot_titles=groups * n_cols,
-                row_titles=[
-                    f'<b>{f}</b>' for f in cols],
-                vertical_spacing=vertical_spacing)
+            with profiler.stage('make_subplots', file=file):
+                fig = make_subplots(
+                    rows=n_cols,
+                    cols=n_groups,
+                    subplot_titles=groups * n_cols,
+                    row_titles=[
+                        f'<b>{f}</b>' for f in cols],
+                    vertical_spacing=vertical_spacing)
 
+            traces = []
+            n_capped = 0
             nrow = 0
             for col in cols:
                 nrow += 1
-                for group in groups:
-                    ncol = groups.index(group) + 1
+                for ncol, group in enumerate(groups, start=1):
                     showlegend = False
                     if ncol == 1 and nrow == 1:
                         showlegend = True
 
-                    x = base_df.copy()
-                    y = feature_df.copy()
-
-                    if group:
-                        x = x.loc[x[display_columns[0]] == group, :]
-                        y = y.loc[y[display_columns[0]] == group, :]
+                    x, y, sizes, color, text = prepared[group]
 
                     if aggregate_function:
-                        x = x.assign(count=1)
-                        sizes = x.groupby(aggregate_columns)[['count']].sum().reset_index()
-
-                        if aggregate_function == 'sum':
-                            x = x.groupby(aggregate_columns).sum().reset_index()
-                            y = y.groupby(aggregate_columns).sum().reset_index()
-                        elif aggregate_function == 'mean':
-                            x = x.groupby(aggregate_columns).mean().reset_index()
-                            y = y.groupby(aggregate_columns).mean().reset_index()
-
-                        for agg_col in sorted(list(x[aggregate_columns[0]].unique())):
-                            x_c = x[x[aggregate_columns[0]] == agg_col]
-                            y_c = y[y[aggregate_columns[0]] == agg_col]
-                            s_c = sizes[sizes[aggregate_columns[0]] == agg_col]
-                            fig.add_trace(go.Scatter(x=x_c[col],
-                                                     y=y_c[col],
-                                                     marker=dict(size=s_c['count'],
-                                                                 line=dict(width=1.5,
-                                                                           color='DarkSlateGrey')),
-                                                     mode='markers',
-                                                     text=s_c['count'],
-                                                     name=agg_col,
-                                                     legendgroup=agg_col,
-                                                     showlegend=False),
-                                          row=nrow, col=ncol)
+                        for i, agg_col in enumerate(x.index):
+                            traces.append((go.Scatter(x=x[col].iloc[i:i + 1],
+                                                      y=y[col].iloc[i:i + 1],
+                                                      marker=dict(size=sizes.iloc[i:i + 1],
+                                                                  line=dict(width=1.5,
+                                                                            color='DarkSlateGrey')),
+                                                      mode='markers',
+                                                      text=text.iloc[i:i + 1],
+                                                      name=agg_col,
+                                                      legendgroup=agg_col,
+                                                      showlegend=False),
+                                           nrow, ncol))
                     else:
-                        color = [colors[0] for i in y[col]]
-                        if 'color_index' in y.columns.values:
-                            color = [colors[i] for i in y['color_index']]
-                        fig.add_trace(go.Scatter(x=x[col],
-                                                 y=y[col],
-                                                 marker=dict(size=12,
-                                                             color=color,
-                                                             line=dict(width=1.5,
-                                                                       color='DarkSlateGrey')),
-                                                 mode='markers',
-                                                 text=x.index,
-                                                 name='',
-                                                 legendgroup=col,
-                                                 showlegend=False),
-                                      row=nrow, col=ncol)
+                        x_col, y_col, point_color, point_size, n_dropped = sample_points(x[col], y[col], color, sizes)
+                        if n_dropped:
+                            n_capped += 1
+
+                        # SVG scatter traces become unusable in the browser beyond a few thousand markers
+                        scatter = go.Scatter
+                        if webgl_threshold and len(x_col) > webgl_threshold:
+                            scatter = go.Scattergl
+
+                        traces.append((scatter(x=x_col,
+                                               y=y_col,
+                                               marker=dict(size=12 if point_size is None else point_size,
+                                                           color=point_color,
+                                                           line=dict(width=1.5,
+                                                                     color='DarkSlateGrey')),
+                                               mode='markers',
+                                               text=x_col.index,
+                                               name='',
+                                               legendgroup=col,
+                                               showlegend=False),
+                                       nrow, ncol))
 
                     min_value, max_value = get_min_max(x[col], y[col], 0, 0)
-                    add_error_lines(fig, showlegend, nrow, ncol, min_value, max_value)
-                    fig.update_xaxes(title_text='base', row=nrow, col=ncol)
-                    fig.update_yaxes(title_text='feature', row=nrow, col=ncol)
+                    for trace in error_lines(showlegend, min_value, max_value):
+                        traces.append((trace, nrow, ncol))
+
+            # Adding all traces in one call avoids re-validating the figure for every subplot
+            if traces:
+                with profiler.stage('add_traces', file=file, traces=len(traces)):
+                    fig.add_traces([t[0] for t in traces], rows=[t[1] for t in traces], cols=[t[2] for t in traces])
+                fig.update_xaxes(title_text='base')
+                fig.update_yaxes(title_text='feature')
 
             fig['layout'].update(template='plotly_white')
             fig.update_layout(width=800 * n_groups, height=600 * n_cols, autosize=False, font=dict(size=12))
@@ -329,14 +997,147 @@ class BaseCompare:
             if self.export_file:
                 filename = self.export_file
 
-            plotly.offline.plot(fig,
-                                filename=os.path.join(self.export_folder, '{filename}'.format(filename=filename)),
-                                auto_open=False)
+            filepath = os.path.join(self.export_folder, '{filename}'.format(filename=filename))
+            if not filepath.endswith('.html'):
+                # plotly appends .html to other file names
+                filepath += '.html'
+            with profiler.stage('plot', file=file):
+                plotly.offline.plot(fig,
+                                    filename=filepath,
+                                    auto_open=False)
+
+            size = os.path.getsize(filepath) / 1000000
+            print("Wrote %s (%.1f MB)" % (filepath, size))
+            if n_capped:
+                print("Warning: %s traces in %s were capped to the %s points furthest from base." % (n_capped, filename, max_points))
+
+
+CSV_CACHE_FOLDER = '.csv_cache'
+MANIFEST_FOLDER = '.compare_manifest'
+CSV_CACHE_MAX_FILES = int(os.environ.get('COMPARE_CSV_CACHE_MAX_FILES', 64))
+
+
+def csv_cache_folder():
+    # COMPARE_CSV_CACHE names the cache folder; it is kept out of the result folders, which are listed file by file
+    cache_folder = os.environ.get('COMPARE_CSV_CACHE')
+    if cache_folder in ['1', 'true', 'True']:
+        cache_folder = os.path.join(tempfile.gettempdir(), 'compare' + CSV_CACHE_FOLDER)
+    return cache_folder
+
+
+def csv_cache_file(csv_file_path, **kwargs):
+    # Parsed copies are keyed by path, size, mtime and the read_csv arguments, so any edit to the csv invalidates them
+    cache_folder = csv_cache_folder()
+    if not cache_folder or not isinstance(csv_file_path, (str, os.PathLike)):
+        return None
+    if 'chunksize' in kwargs or 'iterator' in kwargs:
+        return None
+
+    stat = os.stat(csv_file_path)
+    key = repr((os.path.abspath(csv_file_path), stat.st_size, stat.st_mtime_ns, sorted(kwargs.items())))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    basename, ext = os.path.splitext(os.path.basename(csv_file_path))
+    return os.path.join(cache_folder, '{}.{}.parquet'.format(basename, digest))
+
+
+def write_csv_cache(df, cache_file):
+    cache_folder = os.path.dirname(cache_file)
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder, exist_ok=True)
+
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    try:
+        df.to_parquet(tmp_file)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        # Missing pyarrow or frames parquet can't represent (e.g. mixed-type columns) just aren't cached
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return
+
+    # Evict least recently used copies beyond the cap
+    try:
+        cache_files = [os.path.join(cache_folder, f) for f in os.listdir(cache_folder) if f.endswith('.parquet')]
+        cache_files = sorted(cache_files, key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+    for f in cache_files[CSV_CACHE_MAX_FILES:]:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+
+class FrameCache:
+    # Parsed csvs held in memory by long-running processes (see test/compare_server.py), evicting the least recently
+    # used beyond max_bytes. Keys follow csv_cache_file, so an edited csv is simply a miss.
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.nbytes = 0
+
+    def key(self, csv_file_path, **kwargs):
+        if not self.max_bytes or not isinstance(csv_file_path, (str, os.PathLike)):
+            return None
+        if 'chunksize' in kwargs or 'iterator' in kwargs:
+            return None
+
+        stat = os.stat(csv_file_path)
+        return repr((os.path.abspath(csv_file_path), stat.st_size, stat.st_mtime_ns, sorted(kwargs.items())))
+
+    def get(self, key):
+        if key not in self.frames:
+            return None
+
+        # Callers modify the frames they read, so each gets its own copy
+        self.frames.move_to_end(key)
+        return self.frames[key][0].copy()
+
+    def put(self, key, df):
+        if key is None:
+            return
+
+        nbytes = int(df.memory_usage(index=True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        if key in self.frames:
+            self.nbytes -= self.frames.pop(key)[1]
+        self.frames[key] = (df.copy(), nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self.nbytes -= self.frames.popitem(last=False)[1][1]
+
+
+frame_cache = FrameCache()
 
 
 def read_csv(csv_file_path, **kwargs) -> pd.DataFrame:
-    default_na_values = pd._libs.parsers.STR_NA_VALUES
-    df = pd.read_csv(csv_file_path, na_values=list(default_na_values - {'None'}), keep_default_na=False, **kwargs)
+    frame_key = frame_cache.key(csv_file_path, **kwargs)
+    if frame_key:
+        df = frame_cache.get(frame_key)
+        if df is not None:
+            return df
+
+    df = None
+    cache_file = csv_cache_file(csv_file_path, **kwargs)
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with profiler.stage('read_cache', file=str(csv_file_path)):
+                df = pd.read_parquet(cache_file)
+            os.utime(cache_file)
+        except BaseException:
+            df = None
+
+    if df is None:
+        default_na_values = pd._libs.parsers.STR_NA_VALUES
+        with profiler.stage('read_csv', file=str(csv_file_path)):
+            df = pd.read_csv(csv_file_path, na_values=list(default_na_values - {'None'}), keep_default_na=False, **kwargs)
+
+        if cache_file:
+            write_csv_cache(df, cache_file)
+
+    frame_cache.put(frame_key, df)
     return df
 
 
@@ -345,7 +1146,7 @@ if __name__ == '__main__':
     default_base_folder = 'workflow/tests/base_results'
     default_feature_folder = 'workflow/tests/test_results'
     default_export_folder = 'workflow/tests/comparisons'
-    actions = [method for method in dir(BaseCompare) if method.startswith('__') is False]
+    actions = ['results', 'visualize', 'check']
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', '--base_folder', default=default_base_folder, help='Path of the base folder.')
@@ -353,9 +1154,25 @@ if __name__ == '__main__':
     parser.add_argument('-e', '--export_folder', default=default_export_folder, help='Path of the export folder.')
     parser.add_argument('-x', '--export_file', help='Path of the export file.')
     parser.add_argument('-a', '--actions', action='append', choices=actions, help='Method to call.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes for per-file diffs.')
+    parser.add_argument('--cache', nargs='?', const='', help='Cache parsed csvs as parquet in this folder, or in .csv_cache in the export folder.')
+    parser.add_argument('--chunksize', type=int, help='Diff results_output.csv in chunks of this many rows.')
+    parser.add_argument('--incremental', action='store_true', help='Reuse diffs of rows unchanged since the last run.')
+    parser.add_argument('--webgl_threshold', type=int, default=1000, help='Points per trace above which WebGL scatter is used.')
+    parser.add_argument('--max_points', type=int, default=100000, help='Maximum points per trace in visualize.')
+    parser.add_argument('--profile', help='Write per-stage wall time, CPU time and memory delta to this Chrome trace file.')
+    parser.add_argument('--abs_tol', type=float, default=0.0, help='Absolute tolerance for the check action.')
+    parser.add_argument('--rel_tol', type=float, default=0.0, help='Relative tolerance for the check action.')
+    parser.add_argument('--tolerances', help='JSON file of [absolute, relative] tolerances keyed by column prefix for the check action.')
     args = parser.parse_args()
     print(args)
 
+    if args.profile:
+        profiler.enabled = True
+
+    if args.cache is not None:
+        os.environ['COMPARE_CSV_CACHE'] = os.path.abspath(args.cache or os.path.join(args.export_folder, CSV_CACHE_FOLDER))
+
     if not os.path.exists(args.export_folder):
         os.makedirs(args.export_folder)
 
@@ -364,8 +1181,23 @@ if __name__ == '__main__':
     if args.actions is None:
         args.actions = []
 
+    tolerances = {}
+    if args.tolerances:
+        with open(args.tolerances) as f:
+            tolerances = json.load(f)
+
+    violations = 0
     for action in args.actions:
-        if action == 'results':
-            compare.results()
-        elif action == 'visualize':
-            compare.visualize()
+        with profiler.stage(action):
+            if action == 'results':
+                compare.results(jobs=args.jobs, chunksize=args.chunksize, incremental=args.incremental)
+            elif action == 'visualize':
+                compare.visualize(webgl_threshold=args.webgl_threshold, max_points=args.max_points)
+            elif action == 'check':
+                violations += compare.check(tolerances, args.abs_tol, args.rel_tol)
+
+    if args.profile:
+        profiler.write(args.profile)
+
+    if violations:
+        sys.exit(1)
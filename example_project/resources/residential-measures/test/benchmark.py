@@ -0,0 +1,290 @@
+"""
+Benchmark the comparison and post-processing scripts on synthetic ResStock-scale results:
+- resources/hpxml-measures/workflow/tests/compare.py
+- test/compare.py
+- test/process_bsb_analysis.py
+
+Each action runs in its own process so wall time and peak RSS are measured per action.
+A JSON report is written so regressions can be tracked across releases.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+resstock_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+hpxml_compare = os.path.join(resstock_dir, 'resources', 'hpxml-measures', 'workflow', 'tests', 'compare.py')
+resstock_compare = os.path.join(resstock_dir, 'test', 'compare.py')
+process_bsb_analysis = os.path.join(resstock_dir, 'test', 'process_bsb_analysis.py')
+
+fuels = ['electricity', 'natural_gas', 'propane', 'fuel_oil']
+end_uses = ['cooling', 'heating', 'hot_water', 'lighting_interior', 'plug_loads', 'refrigerator', 'clothes_dryer',
+            'range_oven', 'ceiling_fan', 'pool_pump']
+characteristics = {'geometry_building_type_recs': ['Single-Family Detached', 'Single-Family Attached', 'Mobile Home',
+                                                   'Multi-Family with 2 - 4 Units', 'Multi-Family with 5+ Units'],
+                   'census_region': ['Midwest', 'Northeast', 'South', 'West'],
+                   'geometry_foundation_type': ['Slab', 'Unvented Crawlspace', 'Vented Crawlspace', 'Heated Basement',
+                                                'Unheated Basement', 'Ambient'],
+                   'vintage': ['<1940', '1940s', '1950s', '1960s', '1970s', '1980s', '1990s', '2000s', '2010s'],
+                   'heating_fuel': ['Electricity', 'Natural Gas', 'Propane', 'Fuel Oil', 'None']}
+timeseries_columns = ['Fuel Use: {}: Total'.format(fuel.replace('_', ' ').title()) for fuel in fuels] + \
+                     ['End Use: Electricity: {}'.format(end_use.replace('_', ' ').title()) for end_use in end_uses]
+
+
+def output_columns():
+    cols = ['report_simulation_output.energy_use_total_m_btu', 'report_simulation_output.energy_use_net_m_btu']
+    cols += ['report_simulation_output.fuel_use_{}_total_m_btu'.format(fuel) for fuel in fuels]
+    cols += ['report_simulation_output.end_use_{}_{}_m_btu'.format(fuel, end_use) for fuel in fuels for end_use in end_uses]
+    cols += ['report_utility_bills.bills_{}_total_usd'.format(fuel) for fuel in fuels]
+    cols += ['report_utility_bills.bills_total_usd', 'upgrade_costs.floor_area_conditioned_ft_2', 'qoi_report.qoi_peak_kw']
+    return cols
+
+
+def osw_name(project, i):
+    return '{}-{}.osw'.format(project, '%04d' % i)
+
+
+def generate_annual(folder, n, rng, noise):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    index = pd.Index([osw_name('project_national', i) for i in range(1, n + 1)], name='OSW')
+    cols = output_columns()
+    values = rng.gamma(2.0, 10.0, size=(n, len(cols))).round(3)
+    values *= rng.random((n, len(cols))) > 0.3
+    base_output = pd.DataFrame(values, index=index, columns=cols)
+    base_output.insert(0, 'color_index', 1)
+
+    char = pd.DataFrame({'build_existing_model.{}'.format(k): rng.choice(v, n) for k, v in characteristics.items()},
+                        index=index)
+    char['build_existing_model.sample_weight'] = 1.0
+
+    buildstock = pd.DataFrame({k.replace('_', ' ').title(): rng.choice(v, n) for k, v in characteristics.items()})
+    buildstock.insert(0, 'Building', np.arange(1, n + 1))
+
+    feature_output = base_output.copy()
+    feature_output[cols] = (base_output[cols] * (1 + rng.normal(0, noise, base_output[cols].shape))).round(3)
+
+    for name, output in [('base', base_output), ('feature', feature_output)]:
+        subfolder = os.path.join(folder, name)
+        if not os.path.exists(subfolder):
+            os.makedirs(subfolder)
+        output.to_csv(os.path.join(subfolder, 'results_output.csv'))
+        char.to_csv(os.path.join(subfolder, 'results_characteristics.csv'))
+        buildstock.to_csv(os.path.join(subfolder, 'buildstock.csv'), index=False)
+
+
+def timeseries_frame(n_timesteps, rng):
+    times = pd.date_range('2007-01-01 01:00:00', periods=n_timesteps, freq='h')
+    df = pd.DataFrame(rng.gamma(2.0, 0.5, size=(n_timesteps, len(timeseries_columns))).round(3),
+                      columns=timeseries_columns)
+    df.insert(0, 'Time', times.strftime('%Y/%m/%d %H:%M:%S'))
+    return df
+
+
+def generate_timeseries(folder, n_buildings, n_timesteps, rng, noise):
+    # One PROJECT group per building, as when per-building timeseries are compared instead of project sums
+    for name in ['base', 'feature']:
+        subfolder = os.path.join(folder, name)
+        if not os.path.exists(subfolder):
+            os.makedirs(subfolder)
+
+        dfs = []
+        for i in range(1, n_buildings + 1):
+            df = timeseries_frame(n_timesteps, np.random.default_rng(i))
+            if name == 'feature':
+                df[timeseries_columns] = (df[timeseries_columns] * (1 + rng.normal(0, noise, (n_timesteps, len(timeseries_columns))))).round(3)
+            df.insert(0, 'PROJECT', 'bldg{}'.format('%06d' % i))
+            dfs.append(df)
+        pd.concat(dfs).to_csv(os.path.join(subfolder, 'results_output.csv'), index=False)
+
+
+def generate_buildstockbatch(folder, n, n_timeseries, n_timesteps, rng):
+    # Mirrors the buildstockbatch output layout read by process_bsb_analysis.py
+    projects = [('project_national', 'national_baseline', n), ('project_testing', 'testing_baseline', max(n // 10, 1))]
+    for project, output_directory, n_project in projects:
+        root = os.path.join(folder, project, output_directory)
+
+        results_csvs = os.path.join(root, 'results_csvs')
+        if not os.path.exists(results_csvs):
+            os.makedirs(results_csvs)
+        cols = output_columns()
+        df = pd.DataFrame(rng.gamma(2.0, 10.0, size=(n_project, len(cols))).round(3), columns=cols)
+        for k, v in characteristics.items():
+            df['build_existing_model.{}'.format(k)] = rng.choice(v, n_project)
+        df.insert(0, 'job_id', 0)
+        df.insert(0, 'building_id', np.arange(1, n_project + 1))
+        df.to_csv(os.path.join(results_csvs, 'results_up00.csv'), index=False)
+
+        parquet_folder = os.path.join(root, 'parquet', 'timeseries', 'upgrade=0')
+        if not os.path.exists(parquet_folder):
+            os.makedirs(parquet_folder)
+        dfs = []
+        for i in range(1, min(n_project, n_timeseries) + 1):
+            df = timeseries_frame(n_timesteps, rng)
+
+            run = os.path.join(root, 'simulation_output', 'up00', 'bldg{}'.format('%07d' % i), 'run')
+            if not os.path.exists(run):
+                os.makedirs(run)
+            ts = df.copy()
+            ts.insert(1, 'TimeDST', ts['Time'])
+            ts.insert(2, 'TimeUTC', ts['Time'])
+            units = pd.DataFrame([[''] * 3 + ['kBtu'] * len(timeseries_columns)], columns=ts.columns)
+            pd.concat([units, ts]).to_csv(os.path.join(run, 'results_timeseries.csv'), index=False)
+
+            df.columns = [col.lower().replace(': ', '__').replace(' ', '_') + '__kbtu' if col != 'Time' else 'time' for col in df.columns]
+            df['time'] = pd.to_datetime(df['time'])
+            df.insert(0, 'building_id', i)
+            df['timedst'] = df['time']
+            df['timeutc'] = df['time']
+            dfs.append(df)
+        pd.concat(dfs).set_index('building_id').to_parquet(os.path.join(parquet_folder, 'group0.parquet'))
+
+
+def run_action(cmd, cwd=None):
+    # Waiting on the pid directly gives the rusage of that child alone. stderr goes to a temporary file rather than
+    # a pipe, which a child writing more than the pipe buffer would block on before it could be reaped.
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, cwd=cwd, stdout=devnull, stderr=stderr_file)
+        if hasattr(os, 'wait4'):
+            _, status, rusage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            process.returncode = returncode
+            peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            returncode = process.wait()
+            peak_rss = None
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode('utf-8', errors='replace')
+    wall = time.perf_counter() - start
+
+    result = {'command': ' '.join(cmd), 'wall_seconds': round(wall, 3), 'peak_rss_mb': peak_rss, 'returncode': returncode}
+    if returncode != 0:
+        result['error'] = stderr.strip().splitlines()[-1:] if stderr.strip() else []
+    return result
+
+
+def actions(folder):
+    annual = os.path.join(folder, 'annual')
+    timeseries = os.path.join(folder, 'timeseries')
+    comparisons = os.path.join(folder, 'comparisons')
+    aggregate = ['-ac', 'build_existing_model.census_region', '-af', 'sum']
+    return {
+        'hpxml_results': [sys.executable, hpxml_compare, '-b', os.path.join(annual, 'base'), '-f', os.path.join(annual, 'feature'),
+                          '-e', os.path.join(comparisons, 'hpxml_results'), '-a', 'results'],
+        'results': [sys.executable, resstock_compare, '-b', os.path.join(annual, 'base'), '-f', os.path.join(annual, 'feature'),
+                    '-e', os.path.join(comparisons, 'results'), '-x', 'deltas.csv', '-a', 'results'] + aggregate,
+        'samples': [sys.executable, resstock_compare, '-b', os.path.join(annual, 'base'), '-f', os.path.join(annual, 'feature'),
+                    '-e', os.path.join(comparisons, 'samples'), '-a', 'samples'],
+        'timeseries': [sys.executable, resstock_compare, '-b', os.path.join(timeseries, 'base'), '-f', os.path.join(timeseries, 'feature'),
+                       '-e', os.path.join(comparisons, 'timeseries'), '-a', 'timeseries'],
+        'visualize': [sys.executable, resstock_compare, '-b', os.path.join(annual, 'base'), '-f', os.path.join(annual, 'feature'),
+                      '-e', os.path.join(comparisons, 'visualize'), '-x', 'visualize.html', '-a', 'visualize'] + aggregate,
+        'incremental_results': [sys.executable, resstock_compare, '-b', os.path.join(annual, 'base'), '-f', os.path.join(annual, 'feature'),
+                                '-e', os.path.join(comparisons, 'incremental_results'), '-x', 'deltas.csv', '-a', 'results',
+                                '--incremental', '--chunksize', '1000'] + aggregate,
+        'process_bsb_analysis': [sys.executable, process_bsb_analysis],
+    }
+
+
+def run_incremental(cmd, cwd=None):
+    # Times a repeat of an --incremental run, which must reuse the aggregates the first run saved
+    first = run_action(cmd, cwd)
+    if first['returncode'] != 0:
+        return first
+    aggregates_file = os.path.join(cmd[cmd.index('-e') + 1], '.compare_manifest', 'aggregates.json')
+    saved = os.stat(aggregates_file).st_mtime_ns if os.path.exists(aggregates_file) else None
+
+    result = run_action(cmd, cwd)
+    result['aggregates_reused'] = saved is not None and os.stat(aggregates_file).st_mtime_ns == saved
+    if result['returncode'] == 0 and not result['aggregates_reused']:
+        result['returncode'] = 1
+        result['error'] = ['Aggregates saved by the first run were not reused.']
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=resstock_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except BaseException:
+        return None
+
+
+if __name__ == '__main__':
+
+    default_output_folder = 'test/benchmark'
+    default_actions = ['hpxml_results', 'results', 'incremental_results', 'samples', 'timeseries', 'process_bsb_analysis']
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of buildings to benchmark.')
+    parser.add_argument('-o', '--output_folder', default=default_output_folder, help='Path of the synthetic data and report folder.')
+    parser.add_argument('-r', '--report', help='Path of the JSON report. Defaults to benchmark_report.json in the output folder.')
+    parser.add_argument('-a', '--actions', action='append', choices=list(actions('').keys()), help='Action to time. Defaults to all but visualize.')
+    parser.add_argument('-t', '--timesteps', type=int, default=8760, help='Number of timesteps in the synthetic timeseries.')
+    parser.add_argument('-n', '--timeseries_buildings', type=int, default=50, help='Maximum number of buildings with synthetic timeseries.')
+    parser.add_argument('--noise', type=float, default=0.05, help='Relative noise applied to the feature results.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--keep_data', action='store_true', help='Keep synthetic data after benchmarking.')
+    args = parser.parse_args()
+    print(args)
+
+    if args.actions is None:
+        args.actions = default_actions
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'revision': git_revision(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'timesteps': args.timesteps,
+              'timeseries_buildings': args.timeseries_buildings,
+              'sizes': {}}
+
+    for n in args.sizes:
+        folder = os.path.abspath(os.path.join(args.output_folder, 'n{}'.format(n)))
+        rng = np.random.default_rng(args.seed)
+        n_timeseries = min(n, args.timeseries_buildings)
+
+        start = time.perf_counter()
+        generate_annual(os.path.join(folder, 'annual'), n, rng, args.noise)
+        generate_timeseries(os.path.join(folder, 'timeseries'), n_timeseries, args.timesteps, rng, args.noise)
+        generate_buildstockbatch(folder, n, n_timeseries, args.timesteps, rng)
+        generate_seconds = time.perf_counter() - start
+
+        results = {}
+        cmds = actions(folder)
+        for action in args.actions:
+            print('n={} {}...'.format(n, action))
+            if action == 'incremental_results':
+                results[action] = run_incremental(cmds[action], cwd=folder)
+            else:
+                results[action] = run_action(cmds[action], cwd=folder)
+            print('  {wall_seconds}s, peak RSS {peak_rss_mb} MB'.format(**results[action]))
+
+        report['sizes'][str(n)] = {'generate_seconds': round(generate_seconds, 3), 'actions': results}
+
+        if not args.keep_data:
+            shutil.rmtree(folder)
+
+    report_file = args.report or os.path.join(args.output_folder, 'benchmark_report.json')
+    if not os.path.exists(os.path.dirname(os.path.abspath(report_file))):
+        os.makedirs(os.path.dirname(os.path.abspath(report_file)))
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Wrote {}'.format(report_file))
+
+    failed = [(n, action) for n, size in report['sizes'].items() for action, result in size['actions'].items() if result['returncode'] != 0]
+    for n, action in failed:
+        print('n={} {} failed: {}'.format(n, action, report['sizes'][n]['actions'][action].get('error')))
+    if failed:
+        sys.exit(1)
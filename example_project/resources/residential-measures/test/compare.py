@@ -4,11 +4,28 @@ import argparse
 import numpy as np
 import pandas as pd
 import csv
+import json
 import plotly
 import plotly.graph_objects as go
+from concurrent.futures import ProcessPoolExecutor
 from plotly.subplots import make_subplots
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.abspath(__file__), '../../resources/hpxml-measures/workflow/tests')))
-from compare import BaseCompare, read_csv
+from compare import BaseCompare, read_csv, profiler, CSV_CACHE_FOLDER
+
+# Compiled column mapping plans keyed by mapping file hash and the base/feature columns they were compiled for
+MAP_PLANS = {}
+
+# Energy units found in results column names, as '_kwh' style suffixes or '(kWh)' style labels, and their factor to MBtu.
+# kWh and therm columns are always converted; kBtu columns only when mapped onto an MBtu header, so their labels hold.
+UNIT_FACTORS = {'kwh': 3412.14/1000000,
+                'therm': 0.1,
+                'kbtu': 0.001,
+                'k_btu': 0.001,
+                'mbtu': 1.0,
+                'm_btu': 1.0}
+
+# Per-column conversion factors keyed by header
+UNIT_CONVERSIONS = {}
 
 
 enum_maps = {'build_existing_model.geometry_building_type_recs': {'Single-Family Detached': 'SFD',
@@ -25,20 +42,30 @@ class MoreCompare(BaseCompare):
     self.export_file = export_file
 
     if map_file:
-      self.map_columns(map_file)
+      with profiler.stage('map_columns'):
+        self.map_columns(map_file)
 
 
   def samples(self):
 
-    def value_counts(df, file):
+    def distributions(file):
+      # Marginal distribution of every parameter, counted from category codes; the unique Building ids are never parsed
+      cols = [col for col in read_csv(file, nrows=0).columns if col != 'Building']
+      df = read_csv(file, usecols=cols, dtype='category')
+
+      dists = {}
+      for col in sorted(df.columns):
+        codes = df[col].cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(df[col].cat.categories))
+        keep = counts > 0
+        dists[col] = pd.Series(counts[keep] / counts.sum(), index=df[col].cat.categories[keep])
+      return dists
+
+    def value_counts(dists, file):
       value_counts = []
       with open(file, 'w', newline='') as f:
 
-        for col in sorted(df.columns):
-          if col == 'Building':
-            continue
-
-          value_count = df[col].value_counts(normalize=True)
+        for col, value_count in dists.items():
           value_count = value_count.round(2)
           keys_to_values = dict(zip(value_count.index.values, value_count.values))
           keys_to_values = dict(sorted(keys_to_values.items(), key=lambda x: (x[1], x[0]), reverse=True))
@@ -50,28 +77,153 @@ class MoreCompare(BaseCompare):
         w = csv.writer(f)
         w.writerows(value_counts)
 
-    df = read_csv(os.path.join(self.base_folder, 'buildstock.csv'), dtype=str)
+    def distribution_shift(base_dists, feature_dists, file):
+      # Total variation distance between base and feature per parameter, with the option that moved the most
+      rows = []
+      for col in sorted(set(base_dists) | set(feature_dists)):
+        empty = pd.Series(dtype=float)
+        shift = feature_dists.get(col, empty).sub(base_dists.get(col, empty), fill_value=0).abs()
+        if shift.empty:
+          continue
+        rows.append([col, 0.5 * shift.sum(), shift.max(), shift.idxmax()])
+
+      df = pd.DataFrame(rows, columns=['Parameter', 'Total Variation Distance', 'Max Option Shift', 'Option'])
+      df.round(4).to_csv(file, index=False)
+
+    base_dists = distributions(os.path.join(self.base_folder, 'buildstock.csv'))
     file = os.path.join(self.export_folder, 'base_samples.csv')
-    value_counts(df, file)
+    with profiler.stage('value_counts', file=file):
+      value_counts(base_dists, file)
 
-    df = read_csv(os.path.join(self.feature_folder, 'buildstock.csv'), dtype=str)
+    feature_dists = distributions(os.path.join(self.feature_folder, 'buildstock.csv'))
     file = os.path.join(self.export_folder, 'feature_samples.csv')
-    value_counts(df, file)
-
-  def convert_units(self, df):
-    for col in df.columns:
-      units = col.split('_')[-1]
-      if units == 'kwh':
-          df[col] *= 3412.14/1000000  # to mbtu
-      elif units == 'therm':
-          df[col] *= 0.1  # to mbtu
+    with profiler.stage('value_counts', file=file):
+      value_counts(feature_dists, file)
+
+    file = os.path.join(self.export_folder, 'samples_shift.csv')
+    with profiler.stage('distribution_shift', file=file):
+      distribution_shift(base_dists, feature_dists, file)
+
+  @staticmethod
+  def unit_of(col):
+    col = str(col).strip().lower()
+    if col.endswith(')') and '(' in col:
+      units = col[col.rindex('(') + 1:-1]
+    else:
+      units = col.split('_')
+      units = '_'.join(units[-2:]) if units[-1] == 'btu' else units[-1]
+    if units in UNIT_FACTORS:
+      return units
+    return None
+
+  @staticmethod
+  def unit_factors(columns):
+    # Units are inferred once per header, so repeated conversions of the same results only look up the factors
+    key = tuple(columns)
+    if key not in UNIT_CONVERSIONS:
+      UNIT_CONVERSIONS[key] = np.array([UNIT_FACTORS.get(MoreCompare.unit_of(col), 1.0) for col in columns])
+    return UNIT_CONVERSIONS[key]
+
+  @staticmethod
+  def compile_map_plan(map_dict, results_columns):
+    # Resolves the mapping entries against each frame's columns once: which columns are summed into which,
+    # the unit factor of each output and the final column order
+    map_dict_copy = map_dict.copy()
+    sums = {}
+    for key, columns in results_columns.items():
+      column_headers = set(columns)
+      sums[key] = {}
+      for map_from, map_to in map_dict.items():
+        # Sum 'map to' columns and use first parameter as col name
+        map_to_s = map_to.split(',')
+        if len(map_to_s) > 1:
+          map_to = map_to_s[0]
+          if map_to in column_headers:
+            sums[key][map_to] = map_to_s
+            map_dict_copy[map_from] = map_to
 
-    return
+        # Sum 'map from' columns and use first parameter as col name
+        map_from_s = map_from.split(',')
+        if len(map_from_s) > 1:
+          map_from = map_from_s[0]
+          if map_from in column_headers:
+            sums[key][map_from] = map_from_s
+            map_dict_copy[map_from] = map_to
 
+    # Columns summed into another are dropped, the rest are renamed and only columns in common are kept
+    renamed = {}
+    for key, columns in results_columns.items():
+      dropped = set(col for sources in sums[key].values() for col in sources[1:])
+      renamed[key] = {map_dict_copy.get(col, col): col for col in columns if col not in dropped}
+    common_cols = sorted(set(renamed['base']) & set(renamed['feature']))
+
+    plan = {'columns': common_cols}
+    for key in results_columns:
+      sources = [renamed[key][col] for col in common_cols]
+      factors = MoreCompare.unit_factors(sources).copy()
+      for i, (source, col) in enumerate(zip(sources, common_cols)):
+        if MoreCompare.unit_of(source) in ['kbtu', 'k_btu'] and MoreCompare.unit_of(col) not in ['mbtu', 'm_btu']:
+          factors[i] = 1.0
+      plan[key] = {'sources': sources,
+                   'sums': {col: sums[key][col] for col in sources if col in sums[key]},
+                   'factors': factors}
+    return plan
+
+  @staticmethod
+  def map_plan(map_file, base_columns, feature_columns):
+    # No mapping is needed when one set of columns already contains the other
+    if set(base_columns).issubset(set(feature_columns)) or set(feature_columns).issubset(set(base_columns)):
+      return None
+
+    # Compile the mapping once per mapping file and pair of result columns
+    key = (BaseCompare.file_hash(map_file), tuple(base_columns), tuple(feature_columns))
+    if key not in MAP_PLANS:
+      map_df = read_csv(map_file, usecols=['map_from','map_to'])
+      map_df = map_df.dropna(axis=0)
+      map_dict = {k:v for k,v in zip(map_df['map_from'], map_df['map_to'])}
+      MAP_PLANS[key] = MoreCompare.compile_map_plan(map_dict, {'base': base_columns, 'feature': feature_columns})
+    return MAP_PLANS[key]
+
+  @staticmethod
+  def apply_map_plan(df, plan, columns):
+    # Builds the mapped frame in one pass: summed columns come from a single matrix product, unit conversions
+    # are one broadcast multiply and untouched columns are selected as is
+    sources, sums, factors = plan['sources'], plan['sums'], plan['factors']
+    summed = [i for i, col in enumerate(sources) if col in sums]
+    scaled = [i for i, col in enumerate(sources) if col not in sums and factors[i] != 1.0]
+    kept = [i for i, col in enumerate(sources) if col not in sums and factors[i] == 1.0]
+
+    frames = [df[[sources[i] for i in kept]].set_axis([columns[i] for i in kept], axis=1)]
+    if scaled:
+      values = df[[sources[i] for i in scaled]].to_numpy(dtype=float) * factors[scaled]
+      frames.append(pd.DataFrame(values, index=df.index, columns=[columns[i] for i in scaled]))
+    if summed:
+      inputs = sorted(set(col for i in summed for col in sums[sources[i]]))
+      positions = {col: j for j, col in enumerate(inputs)}
+      matrix = np.zeros((len(inputs), len(summed)))
+      for j, i in enumerate(summed):
+        for col in sums[sources[i]]:
+          matrix[positions[col], j] = 1.0
+      values = np.nan_to_num(df[inputs].to_numpy(dtype=float)) @ matrix * factors[summed]
+      frames.append(pd.DataFrame(values, index=df.index, columns=[columns[i] for i in summed]))
+
+    return pd.concat(frames, axis=1)[columns]
+
+
+  @staticmethod
+  def write_csv(df, path):
+    # Unchanged mapped csvs are left as they are, so a resident process (test/compare_server.py) keeps their parsed copies
+    text = df.to_csv()
+    if os.path.exists(path):
+      with open(path, newline='') as f:
+        if f.read() == text:
+          return
+    with open(path, 'w', newline='') as f:
+      f.write(text)
 
   def write_results(self, base_df, feature_df):
-    base_df.to_csv(os.path.join(self.base_folder, 'results_output.csv'))
-    feature_df.to_csv(os.path.join(self.feature_folder, 'results_output.csv'))
+    self.write_csv(base_df, os.path.join(self.base_folder, 'results_output.csv'))
+    self.write_csv(feature_df, os.path.join(self.feature_folder, 'results_output.csv'))
       
 
   def map_columns(self, map_file):
@@ -92,12 +244,6 @@ class MoreCompare(BaseCompare):
     base_df = read_csv(os.path.join(self.base_folder, 'results_output.csv'), index_col=0)
     feature_df = read_csv(os.path.join(self.feature_folder, 'results_output.csv'), index_col=0)
 
-    ## Mapping
-    cwd = os.path.dirname(os.path.realpath(__file__))
-    map_df = read_csv(map_file, usecols=['map_from','map_to'])
-    map_df = map_df.dropna(axis=0)
-    map_dict = {k:v for k,v in zip(map_df['map_from'], map_df['map_to'])}
-
     # Set new base and feature folders
     self.base_folder = os.path.join(self.base_folder, 'map')
     self.feature_folder = os.path.join(self.feature_folder, 'map')
@@ -119,66 +265,17 @@ class MoreCompare(BaseCompare):
       base_df_char = base_df_char[common_cols]
       feature_df_char = feature_df_char[common_cols]
 
-      base_df_char.to_csv(os.path.join(self.base_folder, 'results_characteristics.csv'))
-      feature_df_char.to_csv(os.path.join(self.feature_folder, 'results_characteristics.csv'))
+      self.write_csv(base_df_char, os.path.join(self.base_folder, 'results_characteristics.csv'))
+      self.write_csv(feature_df_char, os.path.join(self.feature_folder, 'results_characteristics.csv'))
 
     # Skip mapping if not needed
-    if set(base_df.columns).issubset(set(feature_df.columns)) or set(feature_df).issubset(set(base_df.columns)):
+    plan = self.map_plan(map_file, base_df.columns, feature_df.columns)
+    if plan is None:
       self.write_results(base_df, feature_df)
       return
 
-    # Sum columns with more than 1 column header in mapping csv
-    results_dfs = {'base': base_df, 'feature': feature_df}
-    map_dict_copy = map_dict.copy()
-    for key, df in results_dfs.items():
-      column_headers = df.columns
-
-      for map_from, map_to in map_dict.items():
-        # Sum 'map to' columns and use first parameter as col name
-        map_to_s = map_to.split(',')
-        if len(map_to_s) > 1: 
-          map_to = map_to_s[0]
-          if map_to in column_headers:
-            # sum columns
-            df[map_to] = df[map_to_s].sum(axis=1)
-            # update mapping
-            map_dict_copy[map_from] = map_to 
-            # drop summed columns
-            df.drop(map_to_s[1:], axis='columns', inplace=True)
-
-        # Sum 'map from' columns and use first parameter as col name
-        map_from_s = map_from.split(',')
-        if len(map_from_s)>1:
-          map_from = map_from_s[0]
-          if map_from in column_headers:
-            # sum columns
-            df[map_from] = df[map_from_s].sum(axis=1)
-            # update mapping
-            map_dict_copy[map_from] = map_to
-            # drop summed columns
-            df.drop(map_from_s[1:], axis='columns', inplace=True)
-
-      results_dfs[key] = df
-
-    base_df = results_dfs['base']
-    feature_df = results_dfs['feature']
-
-    # Convert units
-    self.convert_units(base_df)
-    self.convert_units(feature_df)
-   
-    # Map column headers
-    map_dict = map_dict_copy
-    base_df.rename(columns=map_dict, inplace=True)
-    feature_df.rename(columns=map_dict, inplace=True)
-
-    # Output only columns in common
-    common_cols = base_df.columns.intersection(feature_df.columns)
-    base_df = base_df[common_cols]
-    feature_df = feature_df[common_cols]
-
-    base_df = base_df.reindex(sorted(base_df.columns), axis=1)
-    feature_df = feature_df.reindex(sorted(feature_df.columns), axis=1)
+    base_df = self.apply_map_plan(base_df, plan['base'], plan['columns'])
+    feature_df = self.apply_map_plan(feature_df, plan['feature'], plan['columns'])
 
     # Store new mapped csvs
     self.write_results(base_df, feature_df)
@@ -186,40 +283,183 @@ class MoreCompare(BaseCompare):
     return
 
 
-  def timeseries(self):
-    files = []
-    for file in os.listdir(self.base_folder):
-      files.append(file)
-
-    def cvrmse(b, f):
-      if np.all(b == 0):
-        return 'NA'
-
-      s = np.sum((b - f) ** 2)
-      s /= (len(b) - 1)
-      s **= (0.5)
-      s /= np.mean(b)
-      s *= 100.0
-      return s
-
-    def nmbe(b, f):
-      if np.all(b == 0):
-        return 'NA'
+  def upgrades(self, feature_folders, aggregate_column=None, aggregate_function=None, enum_maps={}, map_file=None,
+               weights=None):
+    # Compares many feature folders (e.g. results_up01..upNN) against one baseline that is read, mapped and aggregated
+    # once; per-building diffs go to a subfolder per upgrade and the aggregate deltas of all upgrades to one table
+    aggregate_columns = []
+    if aggregate_column:
+      aggregate_columns.append(aggregate_column)
 
-      s = np.sum(b - f)
-      s /= (len(b) - 1)
-      s /= np.mean(b)
-      s *= 100.0
-      return s
+    base_df = read_csv(os.path.join(self.base_folder, 'results_output.csv'), index_col=0)
 
-    metrics = ['cvrmse', 'nmbe']
+    group_df = None
+    if aggregate_columns:
+      group_df = read_csv(os.path.join(self.base_folder, 'results_characteristics.csv'), index_col=0)
+      if map_file:
+        group_df.columns = ['build_existing_model.' + col if  'build_existing_model' not in col else col for col in group_df.columns]
+      group_df = group_df[aggregate_columns]
+      for col, enum_map in enum_maps.items():
+        if col in aggregate_columns:
+          group_df[col] = group_df[col].map(enum_map)
+
+    # Mapped and aggregated baselines, keyed by the feature header they were mapped against
+    base_dfs = {}
+    base_aggregates = {}
+    deltas = []
+    for feature_folder in feature_folders:
+      upgrade = os.path.basename(os.path.normpath(feature_folder))
+      with profiler.stage('upgrade', upgrade=upgrade):
+        feature_df = read_csv(os.path.join(feature_folder, 'results_output.csv'), index_col=0)
+
+        key = tuple(feature_df.columns)
+        plan = self.map_plan(map_file, base_df.columns, feature_df.columns) if map_file else None
+        if plan is not None:
+          feature_df = self.apply_map_plan(feature_df, plan['feature'], plan['columns'])
+        if key not in base_dfs:
+          b_df = base_df
+          if plan is not None:
+            b_df = self.apply_map_plan(base_df, plan['base'], plan['columns'])
+          base_dfs[key] = b_df.select_dtypes(exclude=['string', 'bool'])
+
+        b_df = self.intersect_rows(base_dfs[key], feature_df)
+        feature_df = self.intersect_rows(feature_df, b_df)
+        feature_df = feature_df.select_dtypes(exclude=['string', 'bool'])
+
+        export_folder = os.path.join(self.export_folder, upgrade)
+        if not os.path.exists(export_folder):
+          os.makedirs(export_folder)
+        df, _, _ = self.diff_frames(b_df, feature_df)
+        df = df.fillna('NA')
+        with profiler.stage('write_csv', file=upgrade):
+          df.to_csv(os.path.join(export_folder, 'results_output.csv'))
+
+        if not aggregate_function:
+          continue
+
+        # The whole-baseline aggregate is shared by every upgrade that kept all of the baseline's buildings
+        with profiler.stage('aggregate', upgrade=upgrade):
+          if len(b_df) == len(base_dfs[key]):
+            if key not in base_aggregates:
+              base_aggregates[key] = self.aggregate_frame(b_df, group_df, aggregate_columns, aggregate_function, weights)
+            base_aggregate = base_aggregates[key]
+          else:
+            base_aggregate = self.aggregate_frame(b_df, group_df, aggregate_columns, aggregate_function, weights)
+          feature_aggregate = self.aggregate_frame(feature_df, group_df, aggregate_columns, aggregate_function, weights)
+
+        df = self.aggregate_deltas(base_aggregate, feature_aggregate, len(b_df), len(feature_df), aggregate_columns)
+        df.insert(0, 'upgrade', upgrade)
+        deltas.append(df)
+
+    if deltas:
+      filepath = os.path.join(self.export_folder, self.export_file or 'deltas_upgrades.csv')
+      pd.concat(deltas).to_csv(filepath)
+      print("Wrote %s" % filepath)
+
+
+  def visualize_categories(self, categories, aggregate_column=None, aggregate_function=None, display_column=None, excludes=[],
+                           enum_maps={}, webgl_threshold=1000, max_points=100000, jobs=1, weights=None):
+    # Renders one figure per output category from a single read of the results. Each column is assigned to its
+    # categories once, and each figure only receives its own columns so categories can render in worker processes.
+    # A column matching no category appears in every figure, as does any column only matching that category.
+    files = self.list_files(self.base_folder, excludes)
+    characteristics_cols = [col for col in [display_column, aggregate_column] if col]
+
+    frames = {}
+    characteristics = {}
+    for folder in [self.base_folder, self.feature_folder]:
+      for file in files:
+        path = os.path.join(folder, file)
+        if os.path.exists(path):
+          frames[path] = read_csv(path, index_col=0)
+      if characteristics_cols:
+        path = os.path.join(folder, 'results_characteristics.csv')
+        characteristics[path] = read_csv(path, index_col=0)[characteristics_cols]
+
+    matches = {}
+    for df in frames.values():
+      for col in df.columns:
+        if col not in matches:
+          matches[col] = set(category for category in categories if category in col)
+
+    export_file, ext = self.export_file.split('.')
+    tasks = []
+    for category in categories:
+      cols = set(col for col, matched in matches.items() if matched <= {category})
+      category_frames = characteristics.copy()
+      for path, df in frames.items():
+        category_frames[path] = df[[col for col in df.columns if col in cols]]
+
+      compare = MoreCompare(self.base_folder, self.feature_folder, self.export_folder,
+                            '{}_{}.{}'.format(export_file, category.strip('.').rstrip('_'), ext), None)
+      args = (aggregate_column, aggregate_function, display_column, excludes, enum_maps, ['color_index'],
+              webgl_threshold, max_points, category_frames, weights)
+      tasks.append((category, compare, args))
+
+    if jobs > 1:
+      with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(self.run_profiled, profiler.enabled, 'visualize', {'category': category}, compare.visualize, *args)
+                   for category, compare, args in tasks]
+        for future in futures:
+          _, events = future.result()
+          profiler.events += events
+    else:
+      for category, compare, args in tasks:
+        with profiler.stage('visualize', category=category):
+          compare.visualize(*args)
+
+
+  def timeseries(self, chunksize=None):
+    files = self.list_files(self.base_folder)
+
+    def group_sums(base_df, feature_df, cols):
+      # Per-group sums behind CVRMSE/NMBE; timesteps are paired by position within each group
+      codes, groups = pd.factorize(base_df.index, sort=True)
+      feature_codes = groups.get_indexer(feature_df.index)
+      counts = np.bincount(codes, minlength=len(groups))
+      if not np.array_equal(counts, np.bincount(feature_codes, minlength=len(groups))):
+        raise ValueError('Base and feature must have the same number of timesteps for each {}.'.format(base_df.index.name))
+
+      b = base_df[cols].to_numpy(dtype=float)[np.argsort(codes, kind='stable')]
+      f = feature_df[cols].to_numpy(dtype=float)[np.argsort(feature_codes, kind='stable')]
+      starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+      d = b - f
+      sums = {'n': np.repeat(counts[:, None], len(cols), axis=1),
+              'base': np.add.reduceat(b, starts, axis=0),
+              'error': np.add.reduceat(d, starts, axis=0),
+              'squared_error': np.add.reduceat(d ** 2, starts, axis=0),
+              'nonzero': np.logical_or.reduceat(b != 0, starts, axis=0).astype(int)}
+      return pd.concat({key: pd.DataFrame(value, index=groups, columns=cols) for key, value in sums.items()}, axis=1)
+
+    def metrics(sums, cols):
+      n = sums['n'].to_numpy()
+      mean = sums['base'].to_numpy() / n
+      with np.errstate(divide='ignore', invalid='ignore'):
+        cvrmse = np.sqrt(sums['squared_error'].to_numpy() / (n - 1)) / mean * 100.0
+        nmbe = sums['error'].to_numpy() / (n - 1) / mean * 100.0
+
+      # All-zero, zero-mean and single-timestep columns have no meaningful CVRMSE/NMBE
+      masked = (sums['nonzero'].to_numpy() == 0) | (mean == 0) | (n < 2)
+      values = np.stack([cvrmse, nmbe], axis=2).astype(object)
+      values[np.stack([masked, masked], axis=2)] = 'NA'
+
+      columns = pd.MultiIndex.from_product([cols, ['CVRMSE (%)', 'NMBE (%)']])
+      return pd.DataFrame(values.reshape(len(sums), -1), index=sums.index.tolist(), columns=columns)
 
     for file in sorted(files):
-      base_df = read_csv(os.path.join(self.base_folder, file), index_col=0)
-      feature_df = read_csv(os.path.join(self.feature_folder, file), index_col=0)
+      base_file = os.path.join(self.base_folder, file)
+      feature_file = os.path.join(self.feature_folder, file)
+
+      if chunksize:
+        base_df = read_csv(base_file, index_col=0, nrows=0)
+        feature_df = read_csv(feature_file, index_col=0, nrows=0)
+      else:
+        base_df = read_csv(base_file, index_col=0)
+        feature_df = read_csv(feature_file, index_col=0)
 
-      base_df = self.intersect_rows(base_df, feature_df)
-      feature_df = self.intersect_rows(feature_df, base_df)
+        base_df = self.intersect_rows(base_df, feature_df)
+        feature_df = self.intersect_rows(feature_df, base_df)
 
       cols = sorted(list(set(base_df.columns) & set(feature_df.columns)))
 
@@ -230,41 +470,51 @@ class MoreCompare(BaseCompare):
       if not cols:
         return
 
-      g = base_df.groupby('PROJECT')
-      groups = g.groups.keys()
-
-      dfs = []
-      for group in groups:
-        b_df = base_df.copy()
-        f_df = feature_df.copy()
-
-        cdfs = []
-        for col in cols:
-          b = b_df.loc[group][col].values
-          f = f_df.loc[group][col].values
-
-          data = {'CVRMSE (%)': [cvrmse(b, f)], 'NMBE (%)': [nmbe(b, f)]}
-          df = pd.DataFrame(data=data, index=[group])
-          columns = [(col, 'CVRMSE (%)'), (col, 'NMBE (%)')]
-          df.columns = pd.MultiIndex.from_tuples(columns)
-          cdfs.append(df)
-
-        df = pd.concat(cdfs, axis=1)
-        dfs.append(df)
-
-      df = pd.concat(dfs).transpose()
-      df.to_csv(os.path.join(self.export_folder, 'cvrmse_nmbe_{}'.format(file)))
+      with profiler.stage('cvrmse_nmbe', file=file):
+        if chunksize:
+          # Only per-group sums are kept, so neither file is ever fully in memory. Groups are contiguous in the file,
+          # so only the group a chunk ends in can continue into the next chunk; every other group is final.
+          labels, blocks = [], []
+          pending = None
+          for base_df, feature_df in self.aligned_chunks(base_file, feature_file, chunksize):
+            chunk_sums = group_sums(base_df, feature_df, cols)
+            index, values = chunk_sums.index, chunk_sums.to_numpy(dtype=float)
+            if pending is not None:
+              if pending[0] in index:
+                i = index.get_loc(pending[0])
+                values[i] = pending[1] + values[i]
+              else:
+                labels.append(pending[0])
+                blocks.append(pending[1][None, :])
+            last = index.get_loc(base_df.index[-1])
+            pending = (index[last], values[last])
+            labels.extend(index.delete(last))
+            blocks.append(np.delete(values, last, axis=0))
+
+          if pending is None:
+            continue
+          labels.append(pending[0])
+          blocks.append(pending[1][None, :])
+          sums = pd.DataFrame(np.concatenate(blocks), index=labels, columns=chunk_sums.columns)
+          sums = sums.astype(chunk_sums.dtypes)
+          if sums.index.has_duplicates:
+            # A group split into separate runs of rows
+            sums = sums.groupby(level=0).sum()
+          sums = sums.sort_index()
+        else:
+          sums = group_sums(base_df, feature_df, cols)
+
+        df = metrics(sums, cols).transpose()
+      with profiler.stage('write_csv', file=file):
+        df.to_csv(os.path.join(self.export_folder, 'cvrmse_nmbe_{}'.format(file)))
 
 if __name__ == '__main__':
 
   default_base_folder = 'test/base_results/baseline'
   default_feature_folder = 'test/base_results/results'
   default_export_folder = 'test/base_results/comparisons'
-  actions = [method for method in dir(MoreCompare) if method.startswith('__') is False]
-  actions += ['timeseries']
-  aggregate_columns = ['build_existing_model.geometry_building_type_recs',
-                       'build_existing_model.census_region']
-  aggregate_functions = ['sum', 'mean']
+  actions = ['samples', 'results', 'visualize', 'timeseries', 'upgrades', 'check']
+  aggregate_functions = ['sum', 'mean', 'count', 'min', 'max', 'median', 'q05', 'q10', 'q25', 'q75', 'q90', 'q95']
   display_columns = ['build_existing_model.geometry_building_type_recs',
                      'build_existing_model.geometry_foundation_type',
                      'build_existing_model.census_region']
@@ -276,28 +526,69 @@ if __name__ == '__main__':
   parser.add_argument('-e', '--export_folder', default=default_export_folder, help='The path of the export folder.')
   parser.add_argument('-x', '--export_file', help='The path of the export file.')
   parser.add_argument('-a', '--actions', action='append', choices=actions, help='The method to call.')
-  parser.add_argument('-ac', '--aggregate_column', choices=aggregate_columns, help='On which column to aggregate data.')
-  parser.add_argument('-af', '--aggregate_function', choices=aggregate_functions, help='Function to use for aggregating data.')
+  parser.add_argument('-ac', '--aggregate_column', nargs='+', help='On which characteristics column(s) to aggregate data, e.g. build_existing_model.census_region. Visualize and upgrades use the first.')
+  parser.add_argument('-af', '--aggregate_function', nargs='+', choices=aggregate_functions, help='Function(s) to use for aggregating data. Visualize and upgrades use the first.')
   parser.add_argument('-dc', '--display_column', choices=display_columns, help='How to organize the subplots.')
   parser.add_argument('-m', '--map_file', help='Column mapping csv path.')
+  parser.add_argument('--feature_folders', nargs='+', help='Feature folders to compare against the base folder with the upgrades action.')
+  parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes for per-file diffs and for rendering visualize categories.')
+  parser.add_argument('--cache', nargs='?', const='', help='Cache parsed csvs as parquet in this folder, or in .csv_cache in the export folder.')
+  parser.add_argument('--chunksize', type=int, help='Diff results_output.csv and compare timeseries in chunks of this many rows.')
+  parser.add_argument('--incremental', action='store_true', help='Reuse diffs of rows unchanged since the last run.')
+  parser.add_argument('--webgl_threshold', type=int, default=1000, help='Points per trace above which WebGL scatter is used.')
+  parser.add_argument('--max_points', type=int, default=100000, help='Maximum points per trace in visualize.')
+  parser.add_argument('--profile', help='Write per-stage wall time, CPU time and memory delta to this Chrome trace file.')
+  parser.add_argument('--abs_tol', type=float, default=0.0, help='Absolute tolerance for the check action.')
+  parser.add_argument('--rel_tol', type=float, default=0.0, help='Relative tolerance for the check action.')
+  parser.add_argument('--tolerances', help='JSON file of [absolute, relative] tolerances keyed by column prefix for the check action.')
+  parser.add_argument('-w', '--weights', nargs='+', help='Precomputed buildstock.csv(s), as path or project=path, whose sample_weight column weights sums, means and scatter sizes. Rows of projects without weights are skipped.')
+  parser.add_argument('--weights_project', default='project_testing', help='Project whose OSW names the rows of a weights buildstock.csv given without project= map to.')
 
   args = parser.parse_args()
   print(args)
 
+  aggregate_column = args.aggregate_column[0] if args.aggregate_column else None
+  aggregate_function = args.aggregate_function[0] if args.aggregate_function else None
+
+  weights = None
+  if args.weights:
+    weights = MoreCompare.read_project_weights(args.weights, args.weights_project)
+
+  if args.profile:
+    profiler.enabled = True
+
+  if args.cache is not None:
+    os.environ['COMPARE_CSV_CACHE'] = os.path.abspath(args.cache or os.path.join(args.export_folder, CSV_CACHE_FOLDER))
+
   if not os.path.exists(args.export_folder):
     os.makedirs(args.export_folder)
     
-  compare = MoreCompare(args.base_folder, args.feature_folder, args.export_folder, args.export_file, args.map_file)
-
   if args.actions == None:
     args.actions = [] 
 
+  # upgrades maps each of its own feature folders, so the default feature folder is only mapped for other actions
+  map_file = args.map_file
+  if all(action == 'upgrades' for action in args.actions):
+    map_file = None
+
+  compare = MoreCompare(args.base_folder, args.feature_folder, args.export_folder, args.export_file, map_file)
+
+  tolerances = {}
+  if args.tolerances:
+    with open(args.tolerances) as f:
+      tolerances = json.load(f)
+
+  violations = 0
+
   for action in args.actions:
     if action == 'samples':
-      compare.samples()
+      with profiler.stage('samples'):
+        compare.samples()
     elif action == 'results':
       excludes = ['buildstock.csv']
-      compare.results(args.aggregate_column, args.aggregate_function, excludes, enum_maps)
+      with profiler.stage('results'):
+        compare.results(args.aggregate_column, args.aggregate_function, excludes, enum_maps, args.jobs, args.chunksize,
+                        args.incremental, weights)
     elif action == 'visualize':
       excludes = ['buildstock.csv', 'results_characteristics.csv']
       categories = ['.component_load_',
@@ -339,12 +630,23 @@ if __name__ == '__main__':
                     '.bills_3',
                     'upgrade_costs.',
                     'qoi_report.']
-      for category in categories:
-        export_file, ext = args.export_file.split('.')
-        export_file = '{}_{}.{}'.format(export_file, category.strip('.').rstrip('_'), ext)
-        cols_to_ignore = ['color_index'] + categories
-        cols_to_ignore.remove(category)
-        compare = MoreCompare(args.base_folder, args.feature_folder, args.export_folder, export_file, args.map_file)
-        compare.visualize(args.aggregate_column, args.aggregate_function, args.display_column, excludes, enum_maps, cols_to_ignore)
+      compare.visualize_categories(categories, aggregate_column, aggregate_function, args.display_column, excludes,
+                                   enum_maps, args.webgl_threshold, args.max_points, args.jobs, weights)
     elif action == 'timeseries':
-      compare.timeseries()
+      with profiler.stage('timeseries'):
+        compare.timeseries(args.chunksize)
+    elif action == 'upgrades':
+      with profiler.stage('upgrades'):
+        upgrades_compare = MoreCompare(args.base_folder, args.feature_folder, args.export_folder, args.export_file, None)
+        upgrades_compare.upgrades(args.feature_folders or [args.feature_folder], aggregate_column, aggregate_function, enum_maps,
+                         args.map_file, weights)
+    elif action == 'check':
+      excludes = ['buildstock.csv']
+      with profiler.stage('check'):
+        violations += compare.check(tolerances, args.abs_tol, args.rel_tol, excludes)
+
+  if args.profile:
+    profiler.write(args.profile)
+
+  if violations:
+    sys.exit(1)
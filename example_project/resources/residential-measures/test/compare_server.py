@@ -0,0 +1,152 @@
+"""
+Resident comparison server for developer iteration loops:
+- results, timeseries and samples from test/compare.py, answered over HTTP or a Unix socket
+
+Python, pandas and plotly are imported once, and parsed csvs (baselines, mapped results_output.csv) stay in memory
+between requests up to --max_mb, least recently used first out. A request body is a JSON object using the names of
+the test/compare.py arguments; relative paths resolve against the server's working directory.
+
+    python test/compare_server.py --port 8765
+    curl -d '{"feature_folder": "test/base_results/results", "aggregate_column": "build_existing_model.census_region",
+              "aggregate_function": "sum", "export_file": "deltas.csv"}' localhost:8765/results
+    curl --unix-socket /tmp/compare.sock -d '{}' http://localhost/timeseries
+    curl localhost:8765/status
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+import socketserver
+import traceback
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# test/compare.py imports the hpxml-measures compare module by the same name, so it is loaded under another one
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.abspath(__file__), '../../resources/hpxml-measures/workflow/tests')))
+from compare import frame_cache
+
+spec = importlib.util.spec_from_file_location('resstock_compare', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'compare.py'))
+resstock_compare = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(resstock_compare)
+MoreCompare = resstock_compare.MoreCompare
+
+default_base_folder = 'test/base_results/baseline'
+default_feature_folder = 'test/base_results/results'
+default_export_folder = 'test/base_results/comparisons'
+actions = ['results', 'timeseries', 'samples']
+
+
+def run(action, request):
+    export_folder = request.get('export_folder', default_export_folder)
+    if not os.path.exists(export_folder):
+        os.makedirs(export_folder)
+
+    compare = MoreCompare(request.get('base_folder', default_base_folder),
+                          request.get('feature_folder', default_feature_folder),
+                          export_folder,
+                          request.get('export_file'),
+                          request.get('map_file'))
+
+    # Each request reports projects without sample weights again
+    MoreCompare.unweighted_projects.clear()
+
+    if action == 'results':
+        weights = None
+        if request.get('weights'):
+            weights = request['weights']
+            weights = MoreCompare.read_project_weights([weights] if isinstance(weights, str) else weights,
+                                                       request.get('weights_project', 'project_testing'))
+        compare.results(request.get('aggregate_column'), request.get('aggregate_function'), ['buildstock.csv'],
+                        resstock_compare.enum_maps, 1, request.get('chunksize'), request.get('incremental', False), weights)
+    elif action == 'timeseries':
+        compare.timeseries(request.get('chunksize'))
+    elif action == 'samples':
+        compare.samples()
+
+
+def status():
+    return {'frames': len(frame_cache.frames),
+            'cached_mb': round(frame_cache.nbytes / 1000000, 1),
+            'max_mb': round(frame_cache.max_bytes / 1000000, 1)}
+
+
+class CompareHandler(BaseHTTPRequestHandler):
+    # Requests are handled one at a time, so actions never share a frame or an export folder concurrently
+    def reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.strip('/') != 'status':
+            self.reply(404, {'error': 'Unknown path %s.' % self.path})
+            return
+        self.reply(200, status())
+
+    def do_POST(self):
+        action = self.path.strip('/')
+        if action not in actions:
+            self.reply(404, {'error': 'Unknown action %s, expected one of %s.' % (action, actions)})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self.reply(400, {'error': 'Invalid JSON request: %s' % e})
+            return
+
+        start = time.perf_counter()
+        try:
+            run(action, request)
+        except BaseException as e:
+            traceback.print_exc()
+            self.reply(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        body = {'action': action, 'seconds': round(time.perf_counter() - start, 3)}
+        body.update(status())
+        self.reply(200, body)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def get_request(self):
+        # BaseHTTPRequestHandler logs client_address[0], which a Unix socket doesn't have
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on.')
+    parser.add_argument('--socket', help='Listen on this Unix socket path instead of a TCP port.')
+    parser.add_argument('--max_mb', type=int, default=4000, help='Memory budget for parsed csvs kept between requests.')
+    args = parser.parse_args()
+    print(args)
+
+    frame_cache.max_bytes = args.max_mb * 1000000
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, CompareHandler)
+        print('Serving on %s' % args.socket)
+    else:
+        server = HTTPServer((args.host, args.port), CompareHandler)
+        print('Serving on http://%s:%s' % (args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
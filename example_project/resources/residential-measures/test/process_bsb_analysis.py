@@ -1,44 +1,323 @@
 import os
+import re
 import sys
+import argparse
+import numpy as np
 import pandas as pd
-from functools import reduce
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import csv
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.abspath(__file__), '../../resources/hpxml-measures/workflow/tests')))
 from compare import read_csv
 
 
-if __name__ == '__main__':
-
-    col_exclusions = ['applicable',
-                      'include_annual_',
-                      'include_timeseries_',
-                      'output_format',
-                      'timeseries_frequency',
-                      'timestamp_convention',
-                      'timeseries_num_decimal_places',
-                      'upgrade_name',
-                      'add_timeseries_',
-                      'user_output_',
-                      'debug',
-                      'include_monthly_',
-                      'register_annual_',
-                      'register_monthly_']
-
-    # BASELINE
-
-    if not os.path.exists('baseline'):
-      os.makedirs('baseline')
-
-    df_national = read_csv('project_national/national_baseline/results_csvs/results_up00.csv')
-    df_national['building_id'] = df_national['building_id'].apply(lambda x: 'project_national-{}.osw'.format('%04d' % x))
-    df_national.insert(1, 'color_index', 1)
-
-    df_testing = read_csv('project_testing/testing_baseline/results_csvs/results_up00.csv')
-    df_testing['building_id'] = df_testing['building_id'].apply(lambda x: 'project_testing-{}.osw'.format('%04d' % x))
-    df_testing.insert(1, 'color_index', 0)
-
-    frames = [df_national, df_testing]
-    df = pd.concat(frames)
+def read_timeseries(csv_file_path, index_col, drops):
+    df = read_csv(csv_file_path, index_col=index_col, skiprows=[1])
+    return df.drop(drops, axis=1)
+
+
+def read_timeseries_files(csv_file_paths, index_col, drops, jobs=1, threads=False):
+    # Yields the parsed files in path order. With jobs > 1 a pool reads up to 2 * jobs files ahead, and results are
+    # still taken in order so the sums are the same as the serial ones.
+    if jobs <= 1:
+        for csv_file_path in csv_file_paths:
+            yield read_timeseries(csv_file_path, index_col, drops)
+        return
+
+    executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    with executor_class(max_workers=jobs) as executor:
+        pending = deque()
+        for csv_file_path in csv_file_paths:
+            pending.append(executor.submit(read_timeseries, csv_file_path, index_col, drops))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def sum_timeseries(csv_file_paths, index_col, drops, jobs=1, threads=False):
+    # Adds each datapoint's timeseries into one array as it is read, so only the running total and the files in flight
+    # are in memory. Rows and columns are registered by Time and name as they first appear and the array grows only
+    # when a file brings new ones. Sums match chaining DataFrame.add(fill_value=0) over the files in the same order.
+    rows, cols, total = None, None, None
+    ints = set()
+    aligned = True
+    for df in read_timeseries_files(csv_file_paths, index_col, drops, jobs, threads):
+        if total is None:
+            rows, cols = df.index, df.columns
+            total = np.zeros((len(rows), len(cols)))
+            ints = set(df.select_dtypes(include='integer').columns)
+
+        # Register unseen times and columns, growing the preallocated array to fit them
+        new_rows = df.index[rows.get_indexer(df.index) < 0]
+        new_cols = df.columns[cols.get_indexer(df.columns) < 0]
+        if len(new_rows) or len(new_cols):
+            rows, cols = rows.append(new_rows), cols.append(new_cols)
+            total = np.pad(total, ((0, len(new_rows)), (0, len(new_cols))))
+        if len(df.index) != len(rows) or len(df.columns) != len(cols):
+            aligned = False
+        ints &= set(df.select_dtypes(include='integer').columns)
+
+        row_positions = rows.get_indexer(df.index)
+        col_positions = cols.get_indexer(df.columns)
+        values = np.nan_to_num(df.to_numpy(dtype=float))
+        if np.array_equal(row_positions, np.arange(len(rows))) and np.array_equal(col_positions, np.arange(len(cols))):
+            total += values
+        else:
+            total[np.ix_(row_positions, col_positions)] += values
+        del df, values
+
+    if total is None:
+        raise ValueError('No timeseries found.')
+
+    df = pd.DataFrame(total, index=rows, columns=cols)
+    if not aligned:
+        # Unaligned frames produce the sorted union of rows and float columns when added
+        return df.sort_index()
+
+    for col in ints:
+        df[col] = df[col].astype('int64')
+    return df
+
+
+class TimeseriesSum:
+    # Running per-time sums of buildings added in building_id order, using the compensated (Kahan) steps of pandas'
+    # groupby sum, so the result is the same as summing the concatenation sorted by building_id
+    def __init__(self, time_col):
+        self.time_col = time_col
+        self.rows, self.cols = None, None
+        self.sums, self.compensations = None, None
+        self.ints = None
+
+    def add(self, df):
+        # df holds building_id, time and value columns, with each building's rows contiguous and buildings in order
+        time_col = self.time_col
+        values = df.drop(['building_id', time_col], axis=1)
+
+        if self.sums is None:
+            self.rows, self.cols = pd.Index([], dtype=df[time_col].dtype), values.columns[:0]
+            self.sums, self.compensations = np.zeros((0, 0)), np.zeros((0, 0))
+            self.ints = set(values.select_dtypes(include='integer').columns)
+        self.ints &= set(values.select_dtypes(include='integer').columns)
+
+        # Register unseen times and columns, growing the running sums to fit them
+        times = pd.Index(df[time_col].unique())
+        new_rows = times[self.rows.get_indexer(times) < 0]
+        new_cols = values.columns[self.cols.get_indexer(values.columns) < 0]
+        if len(new_rows) or len(new_cols):
+            self.rows, self.cols = self.rows.append(new_rows), self.cols.append(new_cols)
+            self.sums = np.pad(self.sums, ((0, len(new_rows)), (0, len(new_cols))))
+            self.compensations = np.pad(self.compensations, ((0, len(new_rows)), (0, len(new_cols))))
+
+        sums, compensations = self.sums, self.compensations
+        row_positions = self.rows.get_indexer(df[time_col])
+        col_positions = self.cols.get_indexer(values.columns)
+        values = values.to_numpy(dtype=float)
+        buildings = df['building_id'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, buildings[1:] != buildings[:-1]])
+        aligned_cols = np.array_equal(col_positions, np.arange(len(self.cols)))
+        for start, end in zip(starts, np.r_[starts[1:], len(df)]):
+            # Buildings with every registered time and column, in order, update the sums in place
+            index = np.ix_(row_positions[start:end], col_positions)
+            if aligned_cols and np.array_equal(row_positions[start:end], np.arange(len(self.rows))):
+                index = (slice(None), slice(None))
+            s, comp, x = sums[index], compensations[index], values[start:end]
+            present = ~np.isnan(x)
+            y = x - comp
+            t = s + y
+            comp = np.where(present, t - s - y, comp)
+            comp[comp != comp] = 0
+            sums[index] = np.where(present, t, s)
+            compensations[index] = comp
+
+    def frame(self):
+        df = pd.DataFrame(self.sums, index=self.rows.rename(self.time_col), columns=self.cols).sort_index()
+        for col in self.ints:
+            df[col] = df[col].astype('int64')
+        return df
+
+
+def scan_building_ids(fragment, batch_rows):
+    # First building_id of a fragment, and whether its rows are grouped by ascending building_id, reading one batch of
+    # ids at a time
+    first, last, ordered = None, None, True
+    for batch in fragment.to_batches(columns=['building_id'], batch_size=batch_rows, batch_readahead=0, fragment_readahead=0):
+        ids = batch.column('building_id')
+        if not len(ids):
+            continue
+        lo = pc.min(ids).as_py()
+        first = lo if first is None else min(first, lo)
+        if ordered:
+            ordered = (last is None or ids[0].as_py() >= last) and (len(ids) < 2 or pc.all(pc.greater_equal(ids[1:], ids[:-1])).as_py())
+        last = ids[-1].as_py()
+    return first, ordered
+
+
+def add_fragment_batches(total, fragment, columns, batch_rows):
+    # Adds an ordered fragment batch by batch; the rows of the batch's last building are held back until the
+    # building is complete
+    time_col = total.time_col
+    carry = None
+    for batch in fragment.to_batches(columns=['building_id'] + columns, batch_size=batch_rows, batch_readahead=0, fragment_readahead=0):
+        df = batch.to_pandas(ignore_metadata=True)
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
+        if not len(df):
+            continue
+        last = df['building_id'].iloc[-1]
+        complete = df['building_id'] != last
+        carry = df[~complete]
+        df = df[complete]
+        if len(df):
+            total.add(df.sort_values(['building_id', time_col], kind='stable'))
+        del df
+    if carry is not None and len(carry):
+        total.add(carry.sort_values(['building_id', time_col], kind='stable'))
+
+
+def add_spilled_fragment(total, fragment, columns, batch_rows, buckets, spill_folder=None):
+    # Adds an unordered fragment by first spilling its rows to disk in building_id ranges small enough to sort in
+    # memory, then adding the ranges in order
+    time_col = total.time_col
+    first = last = None
+    for batch in fragment.to_batches(columns=['building_id'], batch_size=batch_rows, batch_readahead=0, fragment_readahead=0):
+        if len(batch):
+            lo, hi = pc.min_max(batch.column('building_id')).values()
+            first = lo.as_py() if first is None else min(first, lo.as_py())
+            last = hi.as_py() if last is None else max(last, hi.as_py())
+    if first is None:
+        return
+    width = (last - first) // buckets + 1
+
+    with tempfile.TemporaryDirectory(dir=spill_folder) as tmpdir:
+        writers = {}
+        try:
+            for batch in fragment.to_batches(columns=['building_id'] + columns, batch_size=batch_rows, batch_readahead=0, fragment_readahead=0):
+                keys = pc.divide(pc.subtract(batch.column('building_id'), first), width)
+                for key in pc.unique(keys).to_pylist():
+                    if key not in writers:
+                        writers[key] = pa.ipc.new_file(os.path.join(tmpdir, '{}.arrow'.format(key)), batch.schema)
+                    writers[key].write_batch(batch.filter(pc.equal(keys, key)))
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        for key in sorted(writers):
+            with pa.memory_map(os.path.join(tmpdir, '{}.arrow'.format(key))) as source:
+                df = pa.ipc.open_file(source).read_all().to_pandas(ignore_metadata=True)
+            total.add(df.sort_values(['building_id', time_col], kind='stable'))
+            del df
+
+
+def sum_parquet_timeseries(timeseries_folder, upgrade, index_col, drops, memory_mb=None, spill_folder=None):
+    # Scans the upgrade's partition of the hive-partitioned timeseries, reading only the summed columns, and adds one
+    # building at a time into a running per-time total; the whole dataset is never concatenated or globally sorted.
+    # The result is the same as summing the concatenation sorted by building_id whenever files hold disjoint buildings.
+    # Without memory_mb each file is read whole; with it, files are read in batches sized to the budget, and files
+    # whose rows aren't grouped by ascending building_id are spilled to spill_folder (or the system temp folder) first.
+    dataset = ds.dataset(timeseries_folder, format='parquet', partitioning='hive')
+    skips = set(drops + ['building_id', 'upgrade'])
+    columns = [col for col in dataset.schema.names if col not in skips and not col.startswith('__index_level_')]
+    time_col = index_col[0]
+
+    fragments = list(dataset.get_fragments(filter=ds.field('upgrade') == upgrade))
+    if not fragments:
+        raise ValueError('No timeseries found for upgrade {} in {}.'.format(upgrade, timeseries_folder))
+
+    total = TimeseriesSum(time_col)
+    if memory_mb is None:
+        firsts = [pc.min(fragment.to_table(columns=['building_id'])['building_id']).as_py() for fragment in fragments]
+        for _, fragment in sorted(zip(firsts, fragments), key=lambda x: x[0]):
+            df = fragment.to_table(columns=['building_id'] + columns).to_pandas(ignore_metadata=True)
+            total.add(df.sort_values(['building_id', time_col], kind='stable'))
+            del df
+        return total.frame()
+
+    # A row costs about four copies of its values in flight: arrow batch, pandas frame, sorted frame and float array
+    budget = memory_mb * 1000000
+    row_bytes = 8 * (len(columns) + 1)
+    batch_rows = max(int(budget / (4 * row_bytes)), 1)
+
+    scans = [scan_building_ids(fragment, batch_rows) + (fragment,) for fragment in fragments]
+    scans = [scan for scan in scans if scan[0] is not None]
+    for _, ordered, fragment in sorted(scans, key=lambda x: x[0]):
+        if ordered:
+            add_fragment_batches(total, fragment, columns, batch_rows)
+        else:
+            buckets = max(-(-fragment.count_rows() // batch_rows), 1)
+            add_spilled_fragment(total, fragment, columns, batch_rows, buckets, spill_folder)
+    return total.frame()
+
+
+col_exclusions = ['applicable',
+                  'include_annual_',
+                  'include_timeseries_',
+                  'output_format',
+                  'timeseries_frequency',
+                  'timestamp_convention',
+                  'timeseries_num_decimal_places',
+                  'upgrade_name',
+                  'add_timeseries_',
+                  'user_output_',
+                  'debug',
+                  'include_monthly_',
+                  'register_annual_',
+                  'register_monthly_']
+
+
+def discover_upgrades(projects):
+    # Upgrades are the results_upNN.csv files found in any project's results_csvs
+    upgrades = set()
+    for project in projects:
+        results_csvs = os.path.join(project, 'results_csvs')
+        if os.path.exists(results_csvs):
+            for file in os.listdir(results_csvs):
+                match = re.match(r'results_up(\d+)\.csv$', file)
+                if match:
+                    upgrades.add(int(match.group(1)))
+    return sorted(upgrades)
+
+
+def upgrade_folder(upgrade):
+    return 'baseline' if upgrade == 0 else 'up{}'.format('%02d' % upgrade)
+
+
+def process_project(project, upgrade, color_index, jobs=1, threads=False, memory_mb=None, spill_folder=None):
+    # Annual results, summed datapoint timeseries and summed buildstockbatch timeseries of one project and upgrade;
+    # parts the project didn't produce are None
+    # The project is the output directory's parent, e.g. project_national for project_national/national_baseline
+    name = os.path.basename(os.path.dirname(os.path.normpath(project))) or os.path.normpath(project)
+
+    results_csv = os.path.join(project, 'results_csvs', 'results_up{}.csv'.format('%02d' % upgrade))
+    if not os.path.exists(results_csv):
+        return None, None, None
+    df = read_csv(results_csv)
+    df['building_id'] = df['building_id'].apply(lambda x: '{}-{}.osw'.format(name, '%04d' % x))
+    df.insert(1, 'color_index', color_index)
+
+    df_timeseries = None
+    simulation_output = os.path.join(project, 'simulation_output', 'up{}'.format('%02d' % upgrade))
+    if os.path.exists(simulation_output):
+        dps = sorted(os.listdir(simulation_output))
+        df_timeseries = sum_timeseries([os.path.join(simulation_output, dp, 'run', 'results_timeseries.csv') for dp in dps], ['Time'], ['TimeDST', 'TimeUTC'], jobs, threads).round(1)
+        df_timeseries['PROJECT'] = name
+
+    df_buildstockbatch = None
+    timeseries_folder = os.path.join(project, 'parquet', 'timeseries')
+    if os.path.exists(os.path.join(timeseries_folder, 'upgrade={}'.format(upgrade))):
+        df_buildstockbatch = sum_parquet_timeseries(timeseries_folder, upgrade, ['time'], ['timedst', 'timeutc'], memory_mb, spill_folder).round(1)
+        df_buildstockbatch['PROJECT'] = name
+
+    return df, df_timeseries, df_buildstockbatch
+
+
+def write_upgrade(outdir, frames):
+    # frames holds the process_project results of every project for one upgrade
+    df = pd.concat([f[0] for f in frames if f[0] is not None])
     df = df.rename(columns={'building_id': 'OSW'})
     del df['job_id']
 
@@ -72,16 +351,16 @@ if __name__ == '__main__':
 
     # Annual
 
-    outdir = 'baseline/annual'
-    if not os.path.exists(outdir):
-      os.makedirs(outdir)
+    annual = os.path.join(outdir, 'annual')
+    if not os.path.exists(annual):
+      os.makedirs(annual)
 
     # results_characteristics.csv
     results_characteristics = df[['OSW'] + build_existing_models]
 
     results_characteristics = results_characteristics.set_index('OSW')
     results_characteristics = results_characteristics.sort_index()
-    results_characteristics.to_csv(os.path.join(outdir, 'results_characteristics.csv'))
+    results_characteristics.to_csv(os.path.join(annual, 'results_characteristics.csv'))
 
     # results_output.csv
     results_output = df[['OSW'] + report_simulation_outputs + report_utility_bills + upgrade_costs + qoi_reports]
@@ -89,76 +368,80 @@ if __name__ == '__main__':
 
     results_output = results_output.set_index('OSW')
     results_output = results_output.sort_index()
-    results_output.to_csv(os.path.join(outdir, 'results_output.csv'))
+    results_output.to_csv(os.path.join(annual, 'results_output.csv'))
 
     # Timeseries
 
-    outdir = 'baseline/timeseries'
-    if not os.path.exists(outdir):
-      os.makedirs(outdir)
+    timeseries = os.path.join(outdir, 'timeseries')
+    if not os.path.exists(timeseries):
+      os.makedirs(timeseries)
 
     # results_output.csv
 
-    df_nationals = []
-    df_testings = []
     index_col = ['Time']
-    drops = ['TimeDST', 'TimeUTC']
-
-    dps = sorted(os.listdir('project_national/national_baseline/simulation_output/up00'))
-    for dp in dps:
-      df_national = read_csv('project_national/national_baseline/simulation_output/up00/{}/run/results_timeseries.csv'.format(dp), index_col=index_col, skiprows=[1])
-      df_national = df_national.drop(drops, axis=1)
-      df_nationals.append(df_national)
+    dfs = [f[1] for f in frames if f[1] is not None]
+    if dfs:
+      results_output = pd.concat(dfs).fillna(0)
+      results_output = results_output.reset_index().set_index('PROJECT')
+      results_output = results_output.sort_index()
+      results_output = results_output.reindex(index_col + sorted(results_output.columns.drop(index_col)), axis=1)
+      results_output.to_csv(os.path.join(timeseries, 'results_output.csv'))
 
-    dps = sorted(os.listdir('project_testing/testing_baseline/simulation_output/up00'))
-    for dp in dps:
-      df_testing = read_csv('project_testing/testing_baseline/simulation_output/up00/{}/run/results_timeseries.csv'.format(dp), index_col=index_col, skiprows=[1])
-      df_testing = df_testing.drop(drops, axis=1)
-      df_testings.append(df_testing)
+    # buildstockbatch.csv
 
-    df_national = reduce(lambda x, y: x.add(y, fill_value=0), df_nationals).round(1)
-    df_national['PROJECT'] = 'project_national'
+    index_col = ['time']
+    dfs = [f[2] for f in frames if f[2] is not None]
+    if dfs:
+      buildstockbatch = pd.concat(dfs).fillna(0)
+      buildstockbatch = buildstockbatch.reset_index().set_index('PROJECT')
+      buildstockbatch = buildstockbatch.sort_index()
+      buildstockbatch = buildstockbatch.reindex(index_col + sorted(buildstockbatch.columns.drop(index_col)), axis=1)
+      buildstockbatch.to_csv(os.path.join(timeseries, 'buildstockbatch.csv'))
 
-    df_testing = reduce(lambda x, y: x.add(y, fill_value=0), df_testings).round(1)
-    df_testing['PROJECT'] = 'project_testing'
 
-    results_output = pd.concat([df_national, df_testing]).fillna(0)
-    results_output = results_output.reset_index().set_index('PROJECT')
-    results_output = results_output.sort_index()
-    results_output = results_output.reindex(index_col + sorted(results_output.columns.drop(index_col)), axis=1)
-    results_output.to_csv(os.path.join(outdir, 'results_output.csv'))
+if __name__ == '__main__':
 
-    # buildstockbatch.csv
+    default_projects = ['project_national/national_baseline', 'project_testing/testing_baseline']
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--projects', nargs='+', default=default_projects, help='BuildStockBatch output directories, as <project>/<output_directory>.')
+    parser.add_argument('-u', '--upgrades', type=int, nargs='+', help='Upgrades to process, 0 being the baseline. Defaults to all found in results_csvs.')
+    parser.add_argument('-o', '--output_folder', default='.', help='Folder receiving a baseline (or upNN) folder per upgrade.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of project/upgrade combinations processed concurrently.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of workers reading datapoint timeseries.')
+    parser.add_argument('--threads', action='store_true', help='Read datapoint timeseries with threads instead of processes.')
+    parser.add_argument('-m', '--memory_mb', type=int, help='Memory budget for summing parquet timeseries, shared by the --workers. Reads whole files when not set.')
+    parser.add_argument('--spill_folder', help='Folder for parquet timeseries spilled to disk under --memory_mb. Defaults to the system temp folder.')
+    args = parser.parse_args()
+    print(args)
+
+    upgrades = args.upgrades
+    if upgrades is None:
+      upgrades = discover_upgrades(args.projects)
+
+    # Earlier projects get higher color indexes, so project_national is 1 and project_testing 0 by default
+    memory_mb = args.memory_mb
+    if memory_mb is not None:
+      memory_mb = max(memory_mb // max(args.workers, 1), 1)
+
+    tasks = [(project, upgrade, len(args.projects) - 1 - i, args.jobs, args.threads, memory_mb, args.spill_folder)
+             for upgrade in upgrades for i, project in enumerate(args.projects)]
+
+    frames = {}
+    if args.workers > 1:
+      with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(process_project, *task) for task in tasks]
+        for task, future in zip(tasks, futures):
+          frames.setdefault(task[1], []).append(future.result())
+    else:
+      for task in tasks:
+        frames.setdefault(task[1], []).append(process_project(*task))
+
+    for upgrade in upgrades:
+      if all(f[0] is None for f in frames[upgrade]):
+        print('Warning: no results found for upgrade {}. Skipping...'.format(upgrade))
+        continue
 
-    df_nationals = []
-    df_testings = []
-    index_col = ['time']
-    drops = ['timedst', 'timeutc']
-
-    groups = sorted(os.listdir('project_national/national_baseline/parquet/timeseries/upgrade=0'))
-    for group in groups:
-        df_national = pd.read_parquet('project_national/national_baseline/parquet/timeseries/upgrade=0/{}'.format(group)).reset_index()
-        df_national = df_national.drop(drops, axis=1)
-        df_nationals.append(df_national)
-
-    groups = sorted(os.listdir('project_testing/testing_baseline/parquet/timeseries/upgrade=0'))
-    for group in groups:
-        df_testing = pd.read_parquet('project_testing/testing_baseline/parquet/timeseries/upgrade=0/{}'.format(group)).reset_index()
-        df_testing = df_testing.drop(drops, axis=1)
-        df_testings.append(df_testing)
-
-    df_national = pd.concat(df_nationals).sort_values(['building_id', 'time'])
-    df_national = df_national.drop(['building_id'], axis=1)
-    df_national = df_national.groupby(index_col).sum().round(1)
-    df_national['PROJECT'] = 'project_national'
-
-    df_testing = pd.concat(df_testings).sort_values(['building_id', 'time'])
-    df_testing = df_testing.drop(['building_id'], axis=1)
-    df_testing = df_testing.groupby(index_col).sum().round(1)
-    df_testing['PROJECT'] = 'project_testing'
-
-    buildstockbatch = pd.concat([df_national, df_testing]).fillna(0)
-    buildstockbatch = buildstockbatch.reset_index().set_index('PROJECT')
-    buildstockbatch = buildstockbatch.sort_index()
-    buildstockbatch = buildstockbatch.reindex(index_col + sorted(buildstockbatch.columns.drop(index_col)), axis=1)
-    buildstockbatch.to_csv(os.path.join(outdir, 'buildstockbatch.csv'))
+      outdir = os.path.join(args.output_folder, upgrade_folder(upgrade))
+      write_upgrade(outdir, frames[upgrade])
+      print('Wrote {}'.format(outdir))